@@ -1,9 +1,9 @@
 import argparse
 import configparser
-import copy
 import csv
 import datetime
 import inspect
+import json
 import logging
 import os
 import signal
@@ -14,15 +14,24 @@ import time
 import platform
 import glob
 from distutils.util import strtobool
-from typing import List, Union
+from typing import Dict, List, Optional, Union
 import paho.mqtt.client as mqtt
 
 import schedule
 
+from batrack.events import EventIndex
+from batrack.rules import TriggerRule
 from batrack.sensors import AudioAnalysisUnit, CameraAnalysisUnit, VHFAnalysisUnit, AbstractAnalysisUnit
+from batrack.storage import StorageManager
 
 logger = logging.getLogger(__name__)
 
+# options of the BatRack section and the runs, which are applied without restarting the units
+RELOADABLE = ["always_on", "duty_cycle_s", "trigger_rule", "trigger_hold_s", "trigger_cooldown_s", "audio_budget_mb", "camera_budget_mb", "min_free_mb", "storage_eviction"]
+
+# options evaluated by the run scheduling only
+SCHEDULING = ["start", "stop", "logging_level"]
+
 
 class BatRack(threading.Thread):
     def __init__(
@@ -39,6 +48,13 @@ class BatRack(threading.Thread):
         use_trigger_audio: Union[bool, str] = True,
         use_trigger_camera: Union[bool, str] = True,
         always_on: Union[bool, str] = False,
+        trigger_rule: str = "",
+        trigger_hold_s: float = 0,
+        trigger_cooldown_s: float = 0,
+        audio_budget_mb: float = 0,
+        camera_budget_mb: float = 0,
+        min_free_mb: float = 0,
+        storage_eviction: str = "value",
         mqtt_host: str = "localhost",
         mqtt_port: int = 1883,
         mqtt_keepalive: int = 60,
@@ -54,6 +70,19 @@ class BatRack(threading.Thread):
         start_time_str = datetime.datetime.now().strftime("%Y-%m-%dT%H_%M_%S")
         self.csvfile = open(os.path.join(self.data_path, f"{start_time_str}_{self.name}.csv"), "w")
         self.csv = csv.writer(self.csvfile)
+        self.event_index = EventIndex(os.path.join(self.data_path, f"{start_time_str}_{self.name}.sqlite"))
+
+        # storage budgets per unit, 0 for unlimited
+        self.storage = StorageManager(
+            self.data_path,
+            budgets_bytes=self.__storage_budgets(audio_budget_mb, camera_budget_mb),
+            min_free_bytes=int(float(min_free_mb) * 1024 * 1024),
+            eviction=str(storage_eviction),
+            event_index=self.event_index,
+        )
+        self.audio_budget_mb: float = float(audio_budget_mb)
+        self.camera_budget_mb: float = float(camera_budget_mb)
+        self.min_free_mb: float = float(min_free_mb)
 
         # create instance variables
         self.duty_cycle_s: int = int(duty_cycle_s)
@@ -76,9 +105,15 @@ class BatRack(threading.Thread):
         self.mqtt_keepalive = int(mqtt_keepalive)
         self.mqtt_client = mqtt.Client(client_id=f"{platform.node()}-Trigger", clean_session=False, userdata=self)
         self.mqtt_client.on_publish = self.on_publish
+        self.topic_prefix = f"{platform.node()}/mqttutil/trigger"
+        self.storage_topic_prefix = f"{platform.node()}/mqttutil/storage"
+
+        # reload the configuration on command, equivalent to SIGHUP
+        self.reload_topic = f"{platform.node()}/batrack/reload"
+        self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.message_callback_add(self.reload_topic, self.on_reload)
         self.mqtt_client.connect(self.mqtt_host, port=self.mqtt_port)
         self.mqtt_client.loop_start()
-        self.topic_prefix = f"{platform.node()}/mqttutil/trigger"
 
         # setup vhf
         self.vhf: VHFAnalysisUnit = None
@@ -88,6 +123,8 @@ class BatRack(threading.Thread):
                 use_trigger=use_trigger_vhf,
                 trigger_callback=self.evaluate_triggers,
                 data_path=self.data_path,
+                event_index=self.event_index,
+                storage=self.storage,
             )
             self._units.append(self.vhf)
 
@@ -99,6 +136,8 @@ class BatRack(threading.Thread):
                 use_trigger=use_trigger_audio,
                 trigger_callback=self.evaluate_triggers,
                 data_path=self.data_path,
+                event_index=self.event_index,
+                storage=self.storage,
             )
             self._units.append(self.audio)
 
@@ -110,50 +149,249 @@ class BatRack(threading.Thread):
                 use_trigger=use_trigger_camera,
                 trigger_callback=self.evaluate_triggers,
                 data_path=self.data_path,
+                event_index=self.event_index,
+                storage=self.storage,
             )
             self._units.append(self.camera)
 
+        # optional trigger rule, replacing the use_trigger_* evaluation
+        self.trigger_rule: Optional[TriggerRule] = self.__compile_rule(trigger_rule)
+        self.__set_rule(self.trigger_rule)
+
+        self.trigger_hold_s: float = float(trigger_hold_s)
+        self.trigger_cooldown_s: float = float(trigger_cooldown_s)
+
         self._running: bool = False
         self._trigger: bool = False
+        self._trigger_ts: float = time.time()
+        self._camera_video: Optional[str] = None
+        self._trigger_mono: float = float("-inf")
+        self._untrigger_mono: float = float("-inf")
+        self._trigger_lock = threading.RLock()
+        self._trigger_timer: Optional[threading.Timer] = None
+        self._trigger_deadline: float = float("inf")
 
     @staticmethod
     def on_publish(userdata, result):
         logger.info(f"data published: {userdata} with code {result}")
 
+    @staticmethod
+    def on_connect(client: mqtt.Client, userdata, flags, rc):
+        # (re-)subscribe on every connect, the broker may have lost the session
+        client.subscribe(userdata.reload_topic)
+
+    @staticmethod
+    def on_reload(client: mqtt.Client, userdata, message):
+        # the configuration is reloaded by the main thread, as for SIGHUP
+        logger.info(f"reload requested on '{message.topic}'")
+        os.kill(os.getpid(), signal.SIGHUP)
+
+    @staticmethod
+    def __storage_budgets(audio_budget_mb: float, camera_budget_mb: float) -> Dict[str, int]:
+        return {
+            AudioAnalysisUnit.__name__: int(float(audio_budget_mb) * 1024 * 1024),
+            CameraAnalysisUnit.__name__: int(float(camera_budget_mb) * 1024 * 1024),
+        }
+
+    @staticmethod
+    def __compile_rule(trigger_rule: str) -> Optional[TriggerRule]:
+        if not str(trigger_rule).strip():
+            return None
+
+        return TriggerRule(
+            trigger_rule,
+            units={
+                "vhf": VHFAnalysisUnit.__name__,
+                "audio": AudioAnalysisUnit.__name__,
+                "camera": CameraAnalysisUnit.__name__,
+            },
+        )
+
+    def __set_rule(self, trigger_rule: Optional[TriggerRule]):
+        now = time.monotonic()
+        for unit in self._units:
+            class_name = unit.__class__.__name__
+            unit.report_detections = bool(trigger_rule) and class_name in trigger_rule.counted_units
+
+            # seed a replaced rule with the current triggers of the units
+            if trigger_rule and unit.trigger:
+                trigger_rule.update(class_name, True, now)
+
+        self.trigger_rule = trigger_rule
+
+    def reconfigure(self, run_changes: Dict[str, str], unit_changes: Dict[str, Dict[str, str]]) -> bool:
+        """Apply changed configuration values to the running instance.
+
+        Changes are only applied, if none of them requires to restart the
+        instance; units and sessions not affected by a change keep running.
+        The changes are applied atomically: the values of the instance are
+        validated before any unit is changed, and units reconfigured before
+        a failing unit are restored.
+
+        Args:
+            run_changes (Dict[str, str]): changed values of the BatRack section and the run.
+            unit_changes (Dict[str, Dict[str, str]]): changed values per unit section.
+
+        Raises:
+            ValueError: format of an argument is not valid.
+
+        Returns:
+            bool: False, if the changes require to restart the instance.
+        """
+        units = {unit.__class__.__name__: unit for unit in self._units}
+        # removed options are passed as None, restoring their defaults requires a restart
+        restart = [k for k, v in run_changes.items() if k not in RELOADABLE + SCHEDULING or v is None]
+        for section, changes in unit_changes.items():
+            if section in units:
+                restart += [f"{section}.{k}" for k, v in changes.items() if k not in units[section].RELOADABLE or v is None]
+        if restart:
+            logger.info(f"[{self.name}] changes of {restart} require a restart")
+            return False
+
+        # validate the changes of the instance before changing any unit
+        trigger_rule = self.__compile_rule(run_changes["trigger_rule"]) if "trigger_rule" in run_changes else self.trigger_rule
+        always_on = run_changes.get("always_on", self.always_on)
+        always_on = strtobool(always_on) if isinstance(always_on, str) else bool(always_on)
+        trigger_hold_s = float(run_changes.get("trigger_hold_s", self.trigger_hold_s))
+        trigger_cooldown_s = float(run_changes.get("trigger_cooldown_s", self.trigger_cooldown_s))
+        duty_cycle_s = int(run_changes.get("duty_cycle_s", self.duty_cycle_s))
+        audio_budget_mb = float(run_changes.get("audio_budget_mb", self.audio_budget_mb))
+        camera_budget_mb = float(run_changes.get("camera_budget_mb", self.camera_budget_mb))
+        min_free_mb = float(run_changes.get("min_free_mb", self.min_free_mb))
+        storage_eviction = str(run_changes.get("storage_eviction", self.storage.eviction))
+        StorageManager.check_eviction(storage_eviction)
+
+        # reconfigure the units, restoring the reconfigured units if a later unit fails
+        reconfigured = []
+        try:
+            for section, changes in unit_changes.items():
+                if section in units and changes:
+                    previous = units[section].get_config(changes)
+                    units[section].reconfigure(**changes)
+                    reconfigured.append((units[section], previous))
+        except ValueError:
+            for unit, previous in reversed(reconfigured):
+                unit.reconfigure(**previous)
+            raise
+
+        self.storage.configure(self.__storage_budgets(audio_budget_mb, camera_budget_mb), int(min_free_mb * 1024 * 1024), storage_eviction)
+        self.audio_budget_mb = audio_budget_mb
+        self.camera_budget_mb = camera_budget_mb
+        self.min_free_mb = min_free_mb
+        self.duty_cycle_s = duty_cycle_s
+
+        with self._trigger_lock:
+            if trigger_rule is not self.trigger_rule:
+                self.__set_rule(trigger_rule)
+            self.always_on = always_on
+            self.trigger_hold_s = trigger_hold_s
+            self.trigger_cooldown_s = trigger_cooldown_s
+
+            if self._running:
+                self.evaluate_triggers(False, "configuration reloaded")
+
+        logger.info(f"[{self.name}] reconfigured: {run_changes}, {unit_changes}")
+        return True
+
     def evaluate_triggers(self, callback_trigger: bool, message: str) -> bool:
+        calling_class = inspect.currentframe().f_back.f_locals["self"].__class__.__name__
+
+        # callbacks arrive from the threads of all units
+        with self._trigger_lock:
+            return self.__evaluate_triggers(callback_trigger, message, calling_class)
+
+    def __evaluate_deadline(self):
+        with self._trigger_lock:
+            # the expired timer is re-armed by the evaluation, if a later deadline is pending
+            if self._trigger_timer is threading.current_thread():
+                self._trigger_timer = None
+            if self._running:
+                self.evaluate_triggers(False, "trigger deadline")
+
+    def __evaluate_triggers(self, callback_trigger: bool, message: str, calling_class: str) -> bool:
         now_time_str = datetime.datetime.now().strftime("%Y-%m-%dT%H_%M_%S")
         self.csv.writerow([now_time_str, callback_trigger, message])
         self.csvfile.flush()
 
-        if self.always_on:
-            trigger = True
+        now = time.monotonic()
+        deadline = None
+
+        if self.trigger_rule:
+            self.trigger_rule.update(calling_class, callback_trigger, now)
+            trigger, deadline = self.trigger_rule.evaluate(now)
+            trigger = trigger or self.always_on
+
         else:
-            trigger = False
+            if self.always_on:
+                trigger = True
+            else:
+                trigger = False
 
-        # if any of the used triggers fires, the system trigger is set
-        for unit in self._units:
-            logger.debug(f"trigger evaluation {unit.__class__.__name__} use_trigger: {unit.use_trigger}, trigger: {unit.trigger}")
-            if unit.use_trigger:
-                if unit.trigger:
-                    trigger = True
+            # if any of the used triggers fires, the system trigger is set
+            for unit in self._units:
+                logger.debug(f"trigger evaluation {unit.__class__.__name__} use_trigger: {unit.use_trigger}, trigger: {unit.trigger}")
+                if unit.use_trigger:
+                    if unit.trigger:
+                        trigger = True
+
+        # keep the system trigger for the hold time, and off for the cool-down time
+        if self._trigger and not trigger and now < self._trigger_mono + self.trigger_hold_s:
+            trigger = True
+            deadline = min(deadline or float("inf"), self._trigger_mono + self.trigger_hold_s)
+        elif not self._trigger and trigger and now < self._untrigger_mono + self.trigger_cooldown_s:
+            trigger = False
+            deadline = min(deadline or float("inf"), self._untrigger_mono + self.trigger_cooldown_s)
+
+        # re-evaluate when time-based conditions expire; a later deadline is picked up when
+        # the armed timer fires, so frequent detections don't start a timer each
+        if deadline is None:
+            if self._trigger_timer:
+                self._trigger_timer.cancel()
+                self._trigger_timer = None
+        elif not self._trigger_timer or deadline < self._trigger_deadline:
+            if self._trigger_timer:
+                self._trigger_timer.cancel()
+            self._trigger_deadline = deadline
+            self._trigger_timer = threading.Timer(deadline - now + 0.01, self.__evaluate_deadline)
+            self._trigger_timer.daemon = True
+            self._trigger_timer.start()
 
         logger.debug(f"trigger evaluation, current state: {trigger}")
 
+        # activity of any sensor resumes the full analysis of gated sensors
+        if callback_trigger:
+            [unit.wake() for unit in self._units]
+
+        # index the event at the current position of the audio stream
+        stream_sample = self.audio.sample_count if self.audio else None
+        self.event_index.add_event(calling_class, callback_trigger, trigger, message, stream_sample)
+
         # start / stop recordings if the system trigger changed
         if trigger != self._trigger:
             self._trigger = trigger
             if trigger:
-                [unit.start_recording() for unit in self._units]
+                self._trigger_ts = time.time()
+                self._trigger_mono = now
+                [unit.start_recording() for unit in self._units if self.storage.admit(unit.__class__.__name__)]
                 logger.info("System triggered, starting recordings")
-                calling_class = inspect.stack()[1][0].f_locals["self"].__class__.__name__
                 self.mqtt_client.publish(f"{self.topic_prefix}/{calling_class}", message)
             else:
+                self._untrigger_mono = now
+                camera_recorded = bool(self.camera and self.camera.recording)
                 [unit.stop_recording() for unit in self._units]
                 logger.info("System un-triggered, stopping recordings")
                 list_of_files = glob.glob('/var/www/html/media/*.h264')
                 latest_file = max(list_of_files, key=os.path.getctime)
                 self.mqtt_client.publish(f"{self.topic_prefix}/latest_video_file", latest_file)
 
+                # camera videos are indexed by time only; only a video recorded for this trigger
+                # is indexed and accounted, not the previous one of a rejected or failed camera
+                if camera_recorded and latest_file != self._camera_video and os.path.getctime(latest_file) >= self._trigger_ts:
+                    self._camera_video = latest_file
+                    recording_id = self.event_index.add_recording(self.camera.__class__.__name__, latest_file, start_ts=self._trigger_ts)
+                    self.event_index.finish_recording(recording_id)
+                    self.storage.add_recording(self.camera.__class__.__name__, latest_file, self._trigger_ts)
+
         return trigger
 
     def run(self):
@@ -168,12 +406,17 @@ class BatRack(threading.Thread):
         # print status reports
         while self._running:
             for unit in self._units:
-                status_str = ", ".join([f"{k}: {'1' if v else '0'}" for k, v in unit.get_status().items()])
+                status_str = ", ".join([f"{k}: {int(v) if isinstance(v, bool) else v}" for k, v in unit.get_status().items()])
                 logger.info(f"{unit.__class__.__name__:20s}: {status_str}")
                 if unit._running and not unit.is_alive():
                     logger.warning(f"{unit.__class__.__name__} is not active, but should run; self-terminating")
                     os.kill(os.getpid(), signal.SIGINT)
 
+                # evict in the background, e.g. if other processes filled the file system, and report the remaining storage capacity
+                self.storage.request_enforce(unit.__class__.__name__)
+                storage_status = self.storage.get_status(unit.__class__.__name__)
+                self.mqtt_client.publish(f"{self.storage_topic_prefix}/{unit.__class__.__name__}", json.dumps(storage_status))
+
             time.sleep(self.duty_cycle_s)
 
         self.mqtt_client.disconnect()
@@ -187,11 +430,15 @@ class BatRack(threading.Thread):
         """
         logger.info(f"Stopping [{self.name}] and respective sensor instances")
         self._running = False
+        if self._trigger_timer:
+            self._trigger_timer.cancel()
 
         [unit.stop() for unit in self._units]
         logger.info(f"Finished cleaning [{self.name}] sensors")
 
         self.join()
+        self.event_index.close()
+        self.storage.close()
 
 
 if __name__ == "__main__":
@@ -235,39 +482,60 @@ if __name__ == "__main__":
             lock.release()
         logger.info(f"[{k}] stopped")
 
-    config_has_runs = 0
-    now = datetime.datetime.now()
+    def get_runs(config) -> List[str]:
+        return [k for k in config.keys() if k.startswith("run")]
 
-    # iterate through runs an enter schedulings
-    for k in config.keys():
-        if not k.startswith("run"):
-            continue
+    def get_run_config(config, k) -> Dict[str, str]:
+        run_config = dict(config["BatRack"])
+        if k in config:
+            run_config.update(config[k])
+        return run_config
 
-        run_config = copy.deepcopy(config["BatRack"])
-        run_config.update(config[k])
+    def schedule_runs(config) -> schedule.Scheduler:
+        """Create the scheduling of the configured runs.
 
-        try:
-            start_s = schedule.every().day.at(run_config["start"])
-            stop_s = schedule.every().day.at(run_config["stop"])
+        Raises:
+            ValueError: a run is not valid.
+        """
+        scheduler = schedule.Scheduler()
+
+        # iterate through runs an enter schedulings
+        for k in get_runs(config):
+            run_config = get_run_config(config, k)
+
+            try:
+                start_s = scheduler.every().day.at(run_config["start"])
+                stop_s = scheduler.every().day.at(run_config["stop"])
+            except KeyError as e:
+                raise ValueError(f"[{k}] is missing a {e} time")
+            except schedule.ScheduleValueError as e:
+                raise ValueError(f"[{k}] {e}")
 
             logger.info(f"[{k}] running from {run_config['start']} to {run_config['stop']}")
 
             start_s.do(create_and_run, config, k, run_config)
             stop_s.do(stop_and_remove, k)
 
-            if now.time() > start_s.at_time:
-                if now.time() < stop_s.at_time:
-                    logger.info(f"[{k}] starting run now (in interval)")
-                    create_and_run(config, k, run_config)
+        return scheduler
 
-            config_has_runs += 1
+    def get_current_run(config) -> Optional[str]:
+        now = datetime.datetime.now().time()
+        for k in get_runs(config):
+            run_config = get_run_config(config, k)
+            if datetime.time.fromisoformat(run_config["start"]) < now < datetime.time.fromisoformat(run_config["stop"]):
+                return k
+        return None
 
-        except KeyError as e:
-            logger.error(f"[{k}] is missing a {e} time, please check the configuration file ({args.configfile}).")
-            sys.exit(1)
-        except schedule.ScheduleValueError as e:
-            logger.error(f"[{k}] {e}, please check the configuration file ({args.configfile}).")
-            sys.exit(1)
+    def diff_section(old, new) -> Dict[str, Optional[str]]:
+        changes = {k: v for k, v in new.items() if old.get(k) != v}
+        changes.update({k: None for k in old if k not in new})
+        return changes
+
+    try:
+        scheduler = schedule_runs(config)
+    except ValueError as e:
+        logger.error(f"{e}, please check the configuration file ({args.configfile}).")
+        sys.exit(1)
 
     running = True
 
@@ -279,15 +547,68 @@ if __name__ == "__main__":
 
         stop_and_remove("SIGINT")
 
+    # create a signal handler to reload the configuration, applying changes to the running instance
+    def reload_handler(sig=None, frame=None):
+        logger.info(f"Caught SIGHUP, reloading configuration file ({args.configfile})...")
+        global config, scheduler
+
+        new_config = configparser.ConfigParser()
+        new_config.read(args.configfile)
+        try:
+            new_scheduler = schedule_runs(new_config)
+        except ValueError as e:
+            logger.error(f"{e}, keeping the previous configuration.")
+            return
+
+        logging.getLogger().setLevel(new_config["BatRack"].get("logging_level", "INFO"))
+
+        # stop an instance, whose run has been removed or no longer contains the current time
+        current_run = get_current_run(new_config) if get_runs(new_config) else "continuous"
+        if instance and instance.name != current_run:
+            stop_and_remove(instance.name)
+
+        if instance:
+            k = instance.name
+            run_changes = diff_section(get_run_config(config, k), get_run_config(new_config, k))
+            unit_changes = {}
+            for section in [VHFAnalysisUnit.__name__, AudioAnalysisUnit.__name__, CameraAnalysisUnit.__name__]:
+                old = config[section] if config.has_section(section) else {}
+                new = new_config[section] if new_config.has_section(section) else {}
+                unit_changes[section] = diff_section(old, new)
+
+            try:
+                reconfigured = instance.reconfigure(run_changes, unit_changes)
+            except ValueError as e:
+                logger.error(f"[{k}] {e}, keeping the previous configuration.")
+                return
+
+            if not reconfigured:
+                stop_and_remove(k)
+                create_and_run(new_config, k, get_run_config(new_config, k))
+
+        config = new_config
+        scheduler = new_scheduler
+
+        # start a run, if the reloaded scheduling contains the current time
+        if not instance and current_run:
+            logger.info(f"[{current_run}] starting run now (in interval)")
+            create_and_run(config, current_run, get_run_config(config, current_run))
+
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP, reload_handler)
 
     # start the run scheduling or run continuously
-    if config_has_runs:
+    if get_runs(config):
+        k = get_current_run(config)
+        if k:
+            logger.info(f"[{k}] starting run now (in interval)")
+            create_and_run(config, k, get_run_config(config, k))
         logger.info("starting run scheduling")
-        while running:
-            schedule.run_pending()
-            time.sleep(1)
     else:
         logger.info("No valid runs have been defined, running continuously.")
-        create_and_run(config, "continuous", config["BatRack"])
\ No newline at end of file
+        create_and_run(config, "continuous", get_run_config(config, "continuous"))
+
+    while running:
+        scheduler.run_pending()
+        time.sleep(1)
@@ -0,0 +1,269 @@
+import argparse
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+# topics published by the BatRack stations, the first level is the hostname of the station
+TOPICS = ["+/mqttutil/trigger/#", "+/mqttutil/storage/#"]
+
+# duration of the time partitions the events are indexed by
+PARTITION_S = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS triggers (
+    ts REAL NOT NULL,
+    hour INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS triggers_hour_node ON triggers (hour, node, unit);
+
+CREATE TABLE IF NOT EXISTS metrics (
+    ts REAL NOT NULL,
+    hour INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS metrics_hour_node ON metrics (hour, node, unit);
+
+CREATE TABLE IF NOT EXISTS videos (
+    ts REAL NOT NULL,
+    hour INTEGER NOT NULL,
+    node TEXT NOT NULL,
+    unit TEXT NOT NULL,
+    payload TEXT
+);
+CREATE INDEX IF NOT EXISTS videos_hour_node ON videos (hour, node);
+"""
+
+# tables of the topic kinds
+TABLES = {"trigger": "triggers", "storage": "metrics"}
+
+# the video of a finished trigger is published on the trigger topic, but is not a trigger
+VIDEO_UNIT = "latest_video_file"
+VIDEO_TABLE = "videos"
+
+Row = Tuple[float, int, str, str, str]
+
+
+class EventStore:
+    def __init__(self, path: str):
+        """Store of the triggers and metrics of a fleet of stations.
+
+        Rows are indexed by their hour, so range queries only visit the
+        partitions of the requested time range.
+
+        Args:
+            path (str): Path of the sqlite database, created if missing.
+        """
+        self.path: str = str(path)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def insert(self, table: str, rows: List[Row]):
+        """Insert a batch of rows in a single transaction.
+
+        Args:
+            table (str): "triggers", "metrics" or "videos".
+            rows (List[Row]): rows of timestamp, hour, node, unit and payload.
+        """
+        with self._lock:
+            self._db.executemany(f"INSERT INTO {table} (ts, hour, node, unit, payload) VALUES (?, ?, ?, ?, ?)", rows)
+            self._db.commit()
+
+    def activity(self, start_ts: float, stop_ts: float, unit: Optional[str] = None) -> List[Tuple[str, int, int]]:
+        """Count the triggers per node and hour.
+
+        Args:
+            start_ts (float): Start of the range.
+            stop_ts (float): End of the range.
+            unit (Optional[str], optional): Only count triggers of this unit.
+
+        Returns:
+            List[Tuple[str, int, int]]: node, start of the hour and number of triggers
+        """
+        query = "SELECT node, hour * ?, COUNT(*) FROM triggers WHERE hour BETWEEN ? AND ?"
+        args = [PARTITION_S, int(start_ts // PARTITION_S), int(stop_ts // PARTITION_S)]
+        if unit:
+            query += " AND unit = ?"
+            args.append(unit)
+        query += " GROUP BY hour, node ORDER BY node, hour"
+
+        with self._lock:
+            return self._db.execute(query, args).fetchall()
+
+
+class Aggregator(threading.Thread):
+    def __init__(
+        self,
+        store: EventStore,
+        mqtt_host: str = "localhost",
+        mqtt_port: int = 1883,
+        mqtt_keepalive: int = 60,
+        batch_size: int = 1000,
+        flush_interval_s: float = 1.0,
+    ):
+        """Subscribe to the topics of all stations and insert the messages in batches.
+
+        Messages are queued by the mqtt thread and written by this thread,
+        so slow disk writes don't stall the reception of messages.
+
+        Args:
+            store (EventStore): Store the messages are written to.
+            mqtt_host (str, optional): Hostname of the mqtt broker.
+            mqtt_port (int, optional): Port of the mqtt broker.
+            mqtt_keepalive (int, optional): Keepalive of the mqtt connection.
+            batch_size (int, optional): Maximum number of rows inserted at once.
+            flush_interval_s (float, optional): Maximum delay of queued rows.
+        """
+        super().__init__()
+        self.store: EventStore = store
+        self.mqtt_host: str = str(mqtt_host)
+        self.mqtt_port: int = int(mqtt_port)
+        self.mqtt_keepalive: int = int(mqtt_keepalive)
+        self.batch_size: int = int(batch_size)
+        self.flush_interval_s: float = float(flush_interval_s)
+
+        self.received: int = 0
+        self.written: int = 0
+        self._running: bool = False
+        self._queue: "queue.Queue[Tuple[str, Row]]" = queue.Queue()
+
+        self.mqtt_client = mqtt.Client(client_id="batrack-aggregate", clean_session=False, userdata=self)
+        self.mqtt_client.on_connect = self.on_connect
+        self.mqtt_client.on_message = self.on_message
+
+    @staticmethod
+    def on_connect(client: mqtt.Client, userdata, flags, rc):
+        logger.info(f"connected to {userdata.mqtt_host}:{userdata.mqtt_port} ({rc}), subscribing to {TOPICS}")
+        client.subscribe([(topic, 1) for topic in TOPICS])
+
+    @staticmethod
+    def on_message(client: mqtt.Client, userdata, message):
+        userdata.add_message(message.topic, message.payload)
+
+    def add_message(self, topic: str, payload: bytes, ts: Optional[float] = None):
+        """Queue a message of a station.
+
+        Args:
+            topic (str): Topic, <node>/mqttutil/<kind>/<unit>.
+            payload (bytes): Payload of the message.
+            ts (Optional[float], optional): Time of the message, defaults to now.
+        """
+        levels = topic.split("/", 3)
+        if len(levels) < 4 or levels[2] not in TABLES:
+            logger.debug(f"ignoring message on '{topic}'")
+            return
+
+        ts = ts or time.time()
+        node, _, kind, unit = levels
+        table = VIDEO_TABLE if kind == "trigger" and unit == VIDEO_UNIT else TABLES[kind]
+        self._queue.put((table, (ts, int(ts // PARTITION_S), node, unit, payload.decode(errors="replace"))))
+        self.received += 1
+
+    def flush(self, block: bool = True) -> int:
+        """Write the queued messages, waiting up to the flush interval for a first message.
+
+        Returns:
+            int: number of written rows
+        """
+        batches = {table: [] for table in list(TABLES.values()) + [VIDEO_TABLE]}
+        count = 0
+        try:
+            table, row = self._queue.get(block=block, timeout=self.flush_interval_s)
+            batches[table].append(row)
+            count += 1
+
+            # collect until the batch is full, or no more messages are queued
+            while count < self.batch_size:
+                table, row = self._queue.get_nowait()
+                batches[table].append(row)
+                count += 1
+        except queue.Empty:
+            pass
+
+        for table, rows in batches.items():
+            if rows:
+                self.store.insert(table, rows)
+
+        self.written += count
+        return count
+
+    def run(self):
+        self._running = True
+        self.mqtt_client.connect(self.mqtt_host, port=self.mqtt_port, keepalive=self.mqtt_keepalive)
+        self.mqtt_client.loop_start()
+
+        last_report = time.monotonic()
+        while self._running:
+            self.flush()
+
+            if time.monotonic() - last_report > 60:
+                logger.info(f"received {self.received}, written {self.written} messages, {self._queue.qsize()} queued")
+                last_report = time.monotonic()
+
+        self.mqtt_client.loop_stop()
+        self.mqtt_client.disconnect()
+
+        # write the remaining messages
+        while self.flush(block=False):
+            pass
+
+    def stop(self):
+        logger.info("stopping aggregation")
+        self._running = False
+        self.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate the triggers and metrics of BatRack stations.")
+    parser.add_argument("store", help="sqlite database of the aggregated messages")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="subscribe to the stations and store their messages")
+    serve_parser.add_argument("--host", default="localhost", help="hostname of the mqtt broker")
+    serve_parser.add_argument("--port", type=int, default=1883, help="port of the mqtt broker")
+    serve_parser.add_argument("--batch-size", type=int, default=1000, help="maximum number of rows inserted at once")
+    serve_parser.add_argument("--flush-interval", type=float, default=1.0, help="maximum delay of queued rows in seconds")
+
+    activity_parser = subparsers.add_parser("activity", help="count the triggers per station and hour")
+    activity_parser.add_argument("--hours", type=float, default=24, help="hours to query, ending now")
+    activity_parser.add_argument("--unit", help="only count triggers of this unit, e.g. AudioAnalysisUnit")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    store = EventStore(args.store)
+
+    if args.command == "serve":
+        aggregator = Aggregator(store, mqtt_host=args.host, mqtt_port=args.port, batch_size=args.batch_size, flush_interval_s=args.flush_interval)
+        aggregator.start()
+        try:
+            aggregator.join()
+        except KeyboardInterrupt:
+            aggregator.stop()
+
+    elif args.command == "activity":
+        now = time.time()
+        for node, hour_ts, count in store.activity(now - args.hours * 3600, now, args.unit):
+            print(node, time.strftime("%Y-%m-%dT%H:%M", time.localtime(hour_ts)), count, sep="\t")
+
+    store.close()
@@ -0,0 +1,327 @@
+import logging
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class BatCall(NamedTuple):
+    """A single bat call detected by the CallDetector."""
+
+    channel: int
+    start_sample: int
+    duration_s: float
+    start_freq_hz: float
+    end_freq_hz: float
+    peak_freq_hz: float
+    peak_db: float
+
+
+class CallDetector:
+    def __init__(
+        self,
+        sampling_rate: int,
+        block_frames: int,
+        highpass_hz: int,
+        lowpass_hz: int,
+        threshold_db: float,
+        channels: int = 1,
+        nfft: int = 256,
+        hop: int = 128,
+        prominence_db: float = 15.0,
+        min_duration_s: float = 0.001,
+        max_duration_s: float = 0.05,
+    ):
+        """Spectral bat call detector with per-call feature extraction.
+
+        Incoming blocks are analysed with a short-time fourier transform of
+        overlapping sub-windows. A sub-window is part of a call, if its
+        in-band peak exceeds threshold_db and stands out from the in-band
+        median by prominence_db, which rejects broadband clicks. Sequences of
+        such sub-windows are reported as calls, if their duration is plausible
+        for a bat call.
+
+        Args:
+            sampling_rate (int): Sampling rate of the samples.
+            block_frames (int): Number of frames per analysed block, used to preallocate buffers.
+            highpass_hz (int): Lower bound of the analysed band.
+            lowpass_hz (int): Upper bound of the analysed band.
+            threshold_db (float): Minimal peak loudness of a call, same scale as AudioAnalysisUnit.threshold_dbfs.
+            channels (int, optional): Number of interleaved channels.
+            nfft (int, optional): Length of a sub-window.
+            hop (int, optional): Distance between the starts of two sub-windows.
+            prominence_db (float, optional): Minimal distance of the peak to the in-band median.
+            min_duration_s (float, optional): Minimal duration of a call.
+            max_duration_s (float, optional): Maximal duration of a call.
+
+        Raises:
+            ValueError: format of an argument is not valid.
+        """
+        self.sampling_rate: int = int(sampling_rate)
+        self.channels: int = int(channels)
+        self.nfft: int = int(nfft)
+        self.hop: int = int(hop)
+
+        if not 0 < self.hop <= self.nfft:
+            raise ValueError(f"hop needs to be in (0, nfft], got {self.hop}")
+
+        self.configure(highpass_hz, lowpass_hz, threshold_db, prominence_db, min_duration_s, max_duration_s)
+
+        # the window is normalized, such that peaks match the scale of AudioAnalysisUnit's block spectrum
+        self._window: np.ndarray = np.hanning(self.nfft).astype(np.float32)
+        self._db_reference: float = float(self._window.sum() / 2.0)
+
+        # reused buffers: unconsumed samples of the previous block followed by the current block
+        self._buffer: np.ndarray = np.zeros((self.channels, self.nfft + int(block_frames)), dtype=np.float32)
+        self._windowed: np.ndarray = np.zeros((self.channels, self.__frame_count(self.nfft + int(block_frames)), self.nfft), dtype=np.float32)
+        self._tail: int = 0
+        self._buffer_start_sample: int = 0
+
+        # calls exceeding a block boundary
+        self._open: List[Optional[Dict]] = [None] * self.channels
+
+        # in-band sub-window magnitudes of the last block, their frequencies and the magnitude of 0 dB
+        self.spectrum: Optional[Tuple[np.ndarray, np.ndarray, float]] = None
+
+    def configure(self, highpass_hz: int, lowpass_hz: int, threshold_db: float, prominence_db: float, min_duration_s: float, max_duration_s: float):
+        """Change the detection parameters, keeping the state of the stream.
+
+        Raises:
+            ValueError: format of an argument is not valid.
+        """
+        freqs_hz = np.fft.rfftfreq(self.nfft, 1.0 / self.sampling_rate)
+        band = np.flatnonzero((freqs_hz >= int(highpass_hz)) & (freqs_hz <= int(lowpass_hz)))
+        if not len(band):
+            raise ValueError(f"no frequency bins between {highpass_hz} and {lowpass_hz} Hz")
+
+        self._band: slice = slice(band[0], band[-1] + 1)
+        self._band_freqs_hz: np.ndarray = freqs_hz[self._band]
+        self.threshold_db: float = float(threshold_db)
+        self.prominence_db: float = float(prominence_db)
+        self.min_duration_s: float = float(min_duration_s)
+        self.max_duration_s: float = float(max_duration_s)
+
+    def __frame_count(self, length: int) -> int:
+        if length < self.nfft:
+            return 0
+        return (length - self.nfft) // self.hop + 1
+
+    def __grow(self, block_frames: int):
+        logger.debug(f"growing detector buffers to {block_frames} frames")
+        buffer = np.zeros((self.channels, self.nfft + block_frames), dtype=np.float32)
+        buffer[:, : self._tail] = self._buffer[:, : self._tail]
+        self._buffer = buffer
+        self._windowed = np.zeros((self.channels, self.__frame_count(self.nfft + block_frames), self.nfft), dtype=np.float32)
+
+    def skip(self, frames: int):
+        """Advance the stream position without analysing samples.
+
+        Calls open at the time of the gap are discarded.
+
+        Args:
+            frames (int): number of skipped frames.
+        """
+        self._buffer_start_sample += self._tail + frames
+        self._tail = 0
+        self._open = [None] * self.channels
+
+    def process(self, samples: np.ndarray) -> List[BatCall]:
+        """Analyse a block of samples and return the calls finished in it.
+
+        Args:
+            samples (np.ndarray): samples of shape (frames, channels).
+
+        Returns:
+            List[BatCall]: calls ended within this block, ordered by channel.
+        """
+        n = samples.shape[0]
+        if self._tail + n > self._buffer.shape[1]:
+            self.__grow(n)
+
+        length = self._tail + n
+        self._buffer[:, self._tail : length] = samples.T
+        self.spectrum = None
+
+        frames = self.__frame_count(length)
+        if not frames:
+            self._tail = length
+            return []
+
+        # strided view of overlapping sub-windows, shape (channels, frames, nfft)
+        s0, s1 = self._buffer.strides
+        view = np.lib.stride_tricks.as_strided(self._buffer, shape=(self.channels, frames, self.nfft), strides=(s0, self.hop * s1, s1), writeable=False)
+        windowed = self._windowed[:, :frames]
+        np.multiply(view, self._window, out=windowed)
+
+        magnitude = np.abs(np.fft.rfft(windowed, axis=2)[:, :, self._band])
+        self.spectrum = (magnitude, self._band_freqs_hz, self._db_reference)
+        peak_index = magnitude.argmax(axis=2)
+        peak_mag = np.take_along_axis(magnitude, peak_index[:, :, None], axis=2)[:, :, 0]
+        floor_mag = np.median(magnitude, axis=2)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            peak_db = 20 * np.log10(peak_mag / self._db_reference)
+            prominence_db = 20 * np.log10(peak_mag / floor_mag)
+        active = (peak_db > self.threshold_db) & (prominence_db > self.prominence_db)
+
+        calls = []
+        for c in range(self.channels):
+            if self._open[c] is None and not active[c].any():
+                continue
+            calls.extend(self.__track(c, active[c], peak_db[c], self._band_freqs_hz[peak_index[c]]))
+
+        # keep unconsumed samples for the next block
+        consumed = frames * self.hop
+        self._tail = length - consumed
+        self._buffer[:, : self._tail] = self._buffer[:, consumed:length]
+        self._buffer_start_sample += consumed
+
+        return calls
+
+    def __track(self, c: int, active: np.ndarray, peak_db: np.ndarray, peak_freqs_hz: np.ndarray) -> List[BatCall]:
+        """Track onsets and offsets of the active sub-windows of a single channel."""
+        frames = len(active)
+        padded = np.concatenate(([self._open[c] is not None], active, [False])).astype(np.int8)
+        edges = np.diff(padded)
+        onsets = list(np.flatnonzero(edges == 1))
+        offsets = np.flatnonzero(edges == -1)
+
+        # the first offset terminates a call continued from the previous block
+        if self._open[c] is not None:
+            onsets.insert(0, None)
+
+        calls = []
+        for start, stop in zip(onsets, offsets):
+            call = self._open[c]
+            if start is None:
+                start = 0
+            else:
+                call = {
+                    "start_sample": int(self._buffer_start_sample + start * self.hop),
+                    "start_freq_hz": float(peak_freqs_hz[start]),
+                    "peak_freq_hz": 0.0,
+                    "peak_db": -np.inf,
+                }
+
+            # a continued call ending at the block boundary keeps the features of the previous block
+            if stop > start:
+                k = start + int(peak_db[start:stop].argmax())
+                if peak_db[k] > call["peak_db"]:
+                    call["peak_db"] = float(peak_db[k])
+                    call["peak_freq_hz"] = float(peak_freqs_hz[k])
+                call["end_freq_hz"] = float(peak_freqs_hz[stop - 1])
+                call["end_sample"] = int(self._buffer_start_sample + stop * self.hop)
+
+            # call continues in the next block
+            if stop == frames:
+                self._open[c] = call
+                continue
+
+            self._open[c] = None
+            duration_s = (call["end_sample"] - call["start_sample"]) / self.sampling_rate
+            if not self.min_duration_s <= duration_s <= self.max_duration_s:
+                logger.debug(f"discarding call on channel {c}, duration {duration_s * 1000:.1f} ms")
+                continue
+
+            calls.append(
+                BatCall(
+                    channel=c,
+                    start_sample=call["start_sample"],
+                    duration_s=duration_s,
+                    start_freq_hz=call["start_freq_hz"],
+                    end_freq_hz=call["end_freq_hz"],
+                    peak_freq_hz=call["peak_freq_hz"],
+                    peak_db=call["peak_db"],
+                )
+            )
+
+        return calls
+
+
+class NoiseFloor:
+    def __init__(
+        self,
+        freq_bins_hz: np.ndarray,
+        highpass_hz: int,
+        lowpass_hz: int,
+        min_db: float,
+        channels: int = 1,
+        bands: int = 8,
+        percentile: float = 0.5,
+        step_db: float = 0.05,
+    ):
+        """Streaming per-band noise floor estimation.
+
+        The pass band is split into bands, and the floor of each band is
+        tracked as an exponential percentile estimate of the band's block
+        peak: each update moves the floor up by step_db * percentile if the
+        band is louder, and down by step_db * (1 - percentile) otherwise.
+        The floor does not fall below min_db, so it recovers quickly once
+        the noise rises again.
+        Updates run in O(bins) on preallocated buffers.
+
+        Args:
+            freq_bins_hz (np.ndarray): Frequencies of the spectrum bins.
+            highpass_hz (int): Lower bound of the tracked band.
+            lowpass_hz (int): Upper bound of the tracked band.
+            min_db (float): Initial and lowest floor of all bands.
+            channels (int, optional): Number of channels, tracked individually.
+            bands (int, optional): Number of bands the pass band is split into.
+            percentile (float, optional): Percentile of the band loudness tracked as floor.
+            step_db (float, optional): Adaption step per update.
+
+        Raises:
+            ValueError: format of an argument is not valid.
+        """
+        self.configure(min_db, percentile, step_db)
+
+        pass_band = np.flatnonzero((freq_bins_hz >= int(highpass_hz)) & (freq_bins_hz <= int(lowpass_hz)))
+        if len(pass_band) < int(bands):
+            raise ValueError(f"pass band of {len(pass_band)} bins can't be split into {bands} bands")
+        self._band_starts: np.ndarray = np.linspace(pass_band[0], pass_band[-1] + 1, int(bands) + 1).astype(int)[:-1]
+        self._band_stop: int = pass_band[-1] + 1
+
+        self.floor_db: np.ndarray = np.full((int(channels), int(bands)), self.min_db)
+
+        # buffers reused by every update
+        self._band_db: np.ndarray = np.empty_like(self.floor_db)
+        self._below: np.ndarray = np.empty(self.floor_db.shape, dtype=bool)
+        self._step: np.ndarray = np.empty_like(self.floor_db)
+
+    def configure(self, min_db: float, percentile: float, step_db: float):
+        """Change the adaption parameters, keeping the current floor.
+
+        Raises:
+            ValueError: format of an argument is not valid.
+        """
+        if not 0 < float(percentile) < 1:
+            raise ValueError(f"percentile needs to be in (0, 1), got {percentile}")
+
+        self.min_db: float = float(min_db)
+        self.percentile: float = float(percentile)
+        self.step_db: float = float(step_db)
+
+    def band_db(self, dbfs_spectrum: np.ndarray) -> np.ndarray:
+        """Compute the peak loudness per band.
+
+        Args:
+            dbfs_spectrum (np.ndarray): spectrum in dBFS, one row per channel.
+
+        Returns:
+            np.ndarray: peak loudness per channel and band, overwritten by the next call.
+        """
+        np.maximum.reduceat(dbfs_spectrum[:, : self._band_stop], self._band_starts, axis=1, out=self._band_db)
+        return self._band_db
+
+    def update(self, band_db: np.ndarray):
+        """Adapt the floor towards the given band loudness.
+
+        Args:
+            band_db (np.ndarray): peak loudness per channel and band.
+        """
+        np.less(band_db, self.floor_db, out=self._below)
+        np.subtract(self.percentile, self._below, out=self._step)
+        self._step *= self.step_db
+        self.floor_db += self._step
+        np.maximum(self.floor_db, self.min_db, out=self.floor_db)
@@ -0,0 +1,228 @@
+import argparse
+import logging
+import os
+import sqlite3
+import threading
+import time
+import wave
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# size of the header written by the wave module for PCM files
+WAVE_HEADER_BYTES = 44
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    unit TEXT NOT NULL,
+    path TEXT NOT NULL,
+    start_ts REAL NOT NULL,
+    stop_ts REAL,
+    stream_sample INTEGER,
+    frames INTEGER,
+    channels INTEGER,
+    sampling_rate INTEGER,
+    sample_width INTEGER,
+    data_offset INTEGER
+);
+CREATE INDEX IF NOT EXISTS recordings_stream_sample ON recordings (stream_sample);
+CREATE INDEX IF NOT EXISTS recordings_start_ts ON recordings (start_ts);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    unit TEXT,
+    trigger INTEGER NOT NULL,
+    system_trigger INTEGER NOT NULL,
+    message TEXT,
+    stream_sample INTEGER
+);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+"""
+
+
+class EventIndex:
+    def __init__(self, path: str):
+        """Sidecar index mapping trigger events to recordings.
+
+        Audio recordings and events are located on the sample counter of the
+        audio stream, so the sample and byte offset of an event inside a
+        wave file can be computed without reading the file. Recordings
+        without a sample counter (e.g. camera videos) are located by time.
+
+        Args:
+            path (str): Path of the sqlite database, created if missing.
+        """
+        self.path: str = str(path)
+
+        # the index is written from the threads of all units
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def add_event(self, unit: Optional[str], trigger: bool, system_trigger: bool, message: str, stream_sample: Optional[int] = None) -> int:
+        """Add a trigger event.
+
+        Args:
+            unit (Optional[str]): Name of the unit reporting the event.
+            trigger (bool): Trigger state of the unit.
+            system_trigger (bool): Trigger state of the system after the event.
+            message (str): Message of the event.
+            stream_sample (Optional[int], optional): Audio stream sample at the time of the event.
+
+        Returns:
+            int: id of the event
+        """
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO events (ts, unit, trigger, system_trigger, message, stream_sample) VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time(), unit, int(trigger), int(system_trigger), message, stream_sample),
+            )
+            self._db.commit()
+            return cur.lastrowid
+
+    def add_recording(
+        self,
+        unit: str,
+        path: str,
+        stream_sample: Optional[int] = None,
+        channels: Optional[int] = None,
+        sampling_rate: Optional[int] = None,
+        sample_width: Optional[int] = None,
+        data_offset: Optional[int] = None,
+        start_ts: Optional[float] = None,
+    ) -> int:
+        """Add a started recording.
+
+        Args:
+            unit (str): Name of the recording unit.
+            path (str): Path of the recorded file.
+            stream_sample (Optional[int], optional): Audio stream sample of the first frame in the file.
+            channels (Optional[int], optional): Number of interleaved channels.
+            sampling_rate (Optional[int], optional): Sampling rate of the recording.
+            sample_width (Optional[int], optional): Bytes per sample.
+            data_offset (Optional[int], optional): Byte offset of the first frame in the file.
+            start_ts (Optional[float], optional): Start time, defaults to now.
+
+        Returns:
+            int: id of the recording
+        """
+        with self._lock:
+            cur = self._db.execute(
+                "INSERT INTO recordings (unit, path, start_ts, stream_sample, channels, sampling_rate, sample_width, data_offset) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (unit, path, start_ts or time.time(), stream_sample, channels, sampling_rate, sample_width, data_offset),
+            )
+            self._db.commit()
+            return cur.lastrowid
+
+    def finish_recording(self, recording_id: int, frames: Optional[int] = None):
+        """Mark a recording as finished.
+
+        Args:
+            recording_id (int): id of the recording.
+            frames (Optional[int], optional): Number of frames written.
+        """
+        with self._lock:
+            self._db.execute("UPDATE recordings SET stop_ts = ?, frames = ? WHERE id = ?", (time.time(), frames, recording_id))
+            self._db.commit()
+
+    def count_trigger_events(self, start_ts: float, stop_ts: float) -> int:
+        """Count the events setting a unit trigger within a time range.
+
+        Args:
+            start_ts (float): Start of the range.
+            stop_ts (float): End of the range.
+
+        Returns:
+            int: number of events
+        """
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM events WHERE trigger = 1 AND ts BETWEEN ? AND ?", (start_ts, stop_ts)).fetchone()[0]
+
+
+def find_clips(db: sqlite3.Connection, event_id: int, before_s: float, after_s: float) -> List[Tuple[str, int, int, int, Tuple[int, int, int]]]:
+    """Locate the audio of an event in the indexed recordings.
+
+    Args:
+        db (sqlite3.Connection): connection to an event index.
+        event_id (int): id of the event.
+        before_s (float): duration to include before the event.
+        after_s (float): duration to include after the event.
+
+    Returns:
+        List[Tuple[str, int, int, int, Tuple[int, int, int]]]: path, sample offset, byte offset, frames and wave parameters per recording
+    """
+    row = db.execute("SELECT stream_sample FROM events WHERE id = ?", (event_id,)).fetchone()
+    if row is None:
+        raise KeyError(f"event {event_id} not found")
+    if row[0] is None:
+        return []
+
+    clips = []
+    for path, start, frames, channels, sampling_rate, sample_width, data_offset in db.execute(
+        "SELECT path, stream_sample, frames, channels, sampling_rate, sample_width, data_offset FROM recordings "
+        "WHERE stream_sample IS NOT NULL AND stream_sample <= ? + ? * sampling_rate AND (frames IS NULL OR stream_sample + frames > ? - ? * sampling_rate) "
+        "ORDER BY stream_sample",
+        (row[0], after_s, row[0], before_s),
+    ):
+        first = max(row[0] - int(before_s * sampling_rate), start)
+        last = row[0] + int(after_s * sampling_rate)
+        if frames is not None:
+            last = min(last, start + frames)
+
+        sample_offset = first - start
+        byte_offset = data_offset + sample_offset * channels * sample_width
+        clips.append((path, sample_offset, byte_offset, last - first, (channels, sample_width, sampling_rate)))
+
+    return clips
+
+
+def cut_clip(path: str, byte_offset: int, frames: int, params: Tuple[int, int, int], out_path: str):
+    """Copy the frames of a clip to a new wave file, seeking instead of reading the whole file."""
+    channels, sample_width, sampling_rate = params
+    with open(path, "rb") as f:
+        f.seek(byte_offset)
+        data = f.read(frames * channels * sample_width)
+
+    with wave.open(out_path, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(sample_width)
+        w.setframerate(sampling_rate)
+        w.writeframes(data)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query a BatRack event index and cut the audio of events.")
+    parser.add_argument("index", help="event index (.sqlite) of a BatRack run")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("events", help="list all events")
+
+    clip_parser = subparsers.add_parser("clip", help="cut the audio of an event")
+    clip_parser.add_argument("event_id", type=int)
+    clip_parser.add_argument("-b", "--before", type=float, default=1.0, help="seconds before the event")
+    clip_parser.add_argument("-a", "--after", type=float, default=5.0, help="seconds after the event")
+    clip_parser.add_argument("-o", "--output", default=".", help="output directory")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    db = sqlite3.connect(args.index)
+
+    if args.command == "events":
+        for event in db.execute("SELECT id, datetime(ts, 'unixepoch', 'localtime'), unit, trigger, system_trigger, message FROM events ORDER BY ts"):
+            print(*event, sep="\t")
+
+    elif args.command == "clip":
+        for path, sample_offset, byte_offset, frames, params in find_clips(db, args.event_id, args.before, args.after):
+            out_path = os.path.join(args.output, f"event{args.event_id}_{os.path.basename(path)}")
+            logger.info(f"cutting {frames} frames at sample {sample_offset} (byte {byte_offset}) of '{path}' to '{out_path}'")
+            cut_clip(path, byte_offset, frames, params, out_path)
@@ -0,0 +1,174 @@
+import csv
+import logging
+import struct
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def write_png(path: str, image: np.ndarray):
+    """Write a grayscale image to a png file, without depending on an imaging library.
+
+    Args:
+        path (str): Path of the png file.
+        image (np.ndarray): uint8 image of shape (rows, columns).
+    """
+    height, width = image.shape
+
+    # each row is prefixed by its filter type, 0 for none
+    raw = np.zeros((height, width + 1), dtype=np.uint8)
+    raw[:, 1:] = image
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 0, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 9)))
+        f.write(chunk(b"IEND", b""))
+
+
+class SpectrogramPreview:
+    def __init__(
+        self,
+        sampling_rate: int,
+        channels: int,
+        highpass_hz: int,
+        lowpass_hz: int,
+        bands: int = 64,
+        column_s: float = 0.1,
+        summary_bands: int = 8,
+        range_db: float = 60.0,
+    ):
+        """Compact spectrogram and per-second band energies of a recording.
+
+        The preview is built while the recording is written, from the
+        spectra already computed by the analysis of each block; the
+        recording is never read again. The spectrum of a block is reduced
+        to the power of equally wide bands between highpass_hz and
+        lowpass_hz, a column of the spectrogram keeps the loudest blocks of
+        column_s.
+
+        Args:
+            sampling_rate (int): Sampling rate of the recording.
+            channels (int): Number of channels, stacked in the spectrogram.
+            highpass_hz (int): Lower bound of the preview.
+            lowpass_hz (int): Upper bound of the preview.
+            bands (int, optional): Number of frequency bands (rows per channel) of the spectrogram.
+            column_s (float, optional): Duration of a spectrogram column.
+            summary_bands (int, optional): Number of bands of the per-second summary.
+            range_db (float, optional): Dynamic range of the spectrogram below its loudest band.
+
+        Raises:
+            ValueError: format of an argument is not valid.
+        """
+        self.sampling_rate: int = int(sampling_rate)
+        self.channels: int = int(channels)
+        self.bands: int = int(bands)
+        self.summary_bands: int = int(summary_bands)
+        self.range_db: float = float(range_db)
+
+        if not 1 <= self.summary_bands <= self.bands:
+            raise ValueError(f"summary_bands must be between 1 and {self.bands}, got {self.summary_bands}")
+        if not 0 <= int(highpass_hz) < int(lowpass_hz):
+            raise ValueError(f"invalid preview band from {highpass_hz} to {lowpass_hz} Hz")
+        if not self.range_db > 0:
+            raise ValueError(f"range_db must be positive, got {self.range_db}")
+
+        self.column_frames: int = max(int(float(column_s) * self.sampling_rate), 1)
+        self.band_edges_hz: np.ndarray = np.linspace(int(highpass_hz), int(lowpass_hz), self.bands + 1)
+        self._summary_starts: np.ndarray = np.linspace(0, self.bands, self.summary_bands + 1).astype(int)
+
+        # band boundaries per frequency axis, the analysis may provide spectra of different resolutions
+        self._bin_edges: Dict[Tuple[int, float], np.ndarray] = {}
+
+        self._frames: int = 0
+        self._columns: List[np.ndarray] = []
+        self._second_energy: List[np.ndarray] = []
+        self._second_frames: List[int] = []
+
+    def __band_power(self, power: np.ndarray, freqs_hz: np.ndarray) -> np.ndarray:
+        key = (len(freqs_hz), float(freqs_hz[0]))
+        edges = self._bin_edges.get(key)
+        if edges is None:
+            edges = np.searchsorted(freqs_hz, self.band_edges_hz)
+            self._bin_edges[key] = edges
+
+        # power per band from the cumulative sum, which is independent of the resolution of the spectrum
+        cumsum = np.zeros(power.shape[:-1] + (power.shape[-1] + 1,))
+        np.cumsum(power, axis=-1, out=cumsum[..., 1:])
+        return cumsum[..., edges[1:]] - cumsum[..., edges[:-1]]
+
+    def add(self, magnitude: np.ndarray, freqs_hz: np.ndarray, reference: float, frames: int):
+        """Add the spectrum of a block.
+
+        Args:
+            magnitude (np.ndarray): spectrum of shape (channels, bins), or sub-window spectra of shape (channels, windows, bins).
+            freqs_hz (np.ndarray): frequency of each bin.
+            reference (float): magnitude of 0 dB.
+            frames (int): number of frames of the block.
+        """
+        power = np.square(np.abs(magnitude) / reference)
+        if power.ndim == 3:
+            power = power.mean(axis=1)
+        band_power = self.__band_power(power, freqs_hz)
+
+        # the block is accounted to the column and second it starts in
+        column = self._frames // self.column_frames
+        while len(self._columns) <= column:
+            self._columns.append(np.zeros((self.channels, self.bands)))
+        np.maximum(self._columns[column], band_power, out=self._columns[column])
+
+        second = self._frames // self.sampling_rate
+        while len(self._second_energy) <= second:
+            self._second_energy.append(np.zeros((self.channels, self.bands)))
+            self._second_frames.append(0)
+        self._second_energy[second] += band_power * frames
+        self._second_frames[second] += frames
+
+        self._frames += frames
+
+    def add_samples(self, samples: np.ndarray):
+        """Add a block, which has not been analysed.
+
+        Args:
+            samples (np.ndarray): samples of shape (frames, channels).
+        """
+        frames = samples.shape[0]
+        spectrum = np.fft.rfft(samples, axis=0).T
+        self.add(spectrum, np.fft.rfftfreq(frames, 1.0 / self.sampling_rate), max(frames / 2.0, 1), frames)
+
+    def write(self, png_path: str, csv_path: str):
+        """Write the spectrogram and the per-second band energies.
+
+        Args:
+            png_path (str): Path of the spectrogram, channels are stacked with high frequencies on top.
+            csv_path (str): Path of the band energies in dB, one row per second and channel.
+        """
+        if not self._columns:
+            logger.info(f"no blocks added, skipping preview '{png_path}'")
+            return
+
+        with np.errstate(divide="ignore"):
+            columns_db = 10 * np.log10(np.stack(self._columns, axis=-1))
+            finite_db = columns_db[np.isfinite(columns_db)]
+            top_db = finite_db.max() if finite_db.size else 0.0
+            image = np.clip((columns_db - top_db + self.range_db) / self.range_db * 255, 0, 255).astype(np.uint8)
+            write_png(png_path, image[:, ::-1, :].reshape(self.channels * self.bands, -1))
+
+            with open(csv_path, "w") as f:
+                writer = csv.writer(f)
+                edges_khz = self.band_edges_hz[self._summary_starts] / 1000
+                writer.writerow(["second", "channel"] + [f"{lo:.0f}-{hi:.0f}kHz" for lo, hi in zip(edges_khz[:-1], edges_khz[1:])])
+
+                for second, (energy, frames) in enumerate(zip(self._second_energy, self._second_frames)):
+                    summary = np.add.reduceat(energy / max(frames, 1), self._summary_starts[:-1], axis=1)
+                    summary_db = 10 * np.log10(summary)
+                    for c in range(self.channels):
+                        writer.writerow([second, c] + [round(float(db), 1) for db in summary_db[c]])
+
+        logger.info(f"wrote preview '{png_path}' ({image.shape[2]} columns) and band energies '{csv_path}'")
@@ -0,0 +1,260 @@
+import collections
+import logging
+import re
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# maximum number of detections kept per unit
+DETECTIONS_MAX = 1024
+
+TOKEN_RE = re.compile(r"\s*(>=|≥|\(|\)|[A-Za-z_][A-Za-z0-9_]*|\d+(?:\.\d+)?)")
+KEYWORDS = {"and", "or", "not", "unless", "within", "s", "sec", "true", "false"}
+
+# a compiled node evaluates to a bool at a given time and adds the times,
+# at which the evaluated result could change without any unit edge, to a list
+Evaluator = Callable[[float, List[float]], bool]
+
+
+class UnitState:
+    def __init__(self):
+        """Trigger state of a single unit, updated on every callback of the unit."""
+        self.active: bool = False
+        self.on_ts: float = float("-inf")
+        self.off_ts: float = float("-inf")
+        self.episode_detections: int = 0
+        self.detections: Deque[float] = collections.deque(maxlen=DETECTIONS_MAX)
+        # largest window the detections are evaluated in
+        self.window_s: float = 0.0
+
+    def update(self, trigger: bool, ts: float):
+        if trigger:
+            if not self.active:
+                self.on_ts = ts
+                self.episode_detections = 0
+            self.episode_detections += 1
+            self.detections.append(ts)
+        elif self.active:
+            self.off_ts = ts
+        self.active = trigger
+
+
+class TriggerRule:
+    def __init__(self, expression: str, units: Dict[str, str]):
+        """Trigger rule compiled from a boolean expression over the units' triggers.
+
+        Grammar::
+
+            rule  := any ("unless" any)?
+            any   := all ("or" all)*
+            all   := unary ("and" unary)* ("within" NUMBER "s")?
+            unary := "not" unary | NAME (">=" NUMBER)? | "true" | "false" | "(" rule ")"
+
+        A NAME is true while the unit is triggered, NAME >= N requires N
+        detections of the unit within its current trigger. Suffixing a
+        conjunction with "within N s" evaluates its units over the last N
+        seconds instead, e.g. "vhf and audio within 5 s" requires both units
+        to be triggered within 5 seconds.
+
+        The expression is compiled once into nested closures, the unit state
+        is updated incrementally on the units' callbacks.
+
+        Args:
+            expression (str): the rule expression.
+            units (Dict[str, str]): mapping of the names used in the expression to unit class names.
+
+        Raises:
+            ValueError: the expression is not valid.
+        """
+        self.expression: str = str(expression)
+        self.units: Dict[str, str] = dict(units)
+        self.states: Dict[str, UnitState] = {class_name: UnitState() for class_name in self.units.values()}
+
+        # units, whose individual detections are evaluated
+        self.counted_units: Set[str] = set()
+
+        self.__tokens: List[str] = self.__tokenize(self.expression)
+        self.__pos: int = 0
+        ast = self.__parse_rule()
+        if self.__pos != len(self.__tokens):
+            raise ValueError(f"unexpected '{self.__tokens[self.__pos]}' in trigger rule '{self.expression}'")
+
+        self.__evaluate: Evaluator = self.__compile(ast, None)
+        logger.info(f"compiled trigger rule '{self.expression}': {ast}")
+
+    def update(self, class_name: str, trigger: bool, ts: float):
+        """Update the state of a unit from its trigger callback.
+
+        Args:
+            class_name (str): class name of the calling unit.
+            trigger (bool): trigger state reported by the unit.
+            ts (float): monotonic time of the callback.
+        """
+        state = self.states.get(class_name)
+        if state:
+            state.update(trigger, ts)
+
+    def evaluate(self, now: float) -> Tuple[bool, Optional[float]]:
+        """Evaluate the rule.
+
+        Args:
+            now (float): current monotonic time.
+
+        Returns:
+            Tuple[bool, Optional[float]]: result, and the next time the result could change without unit callbacks
+        """
+        deadlines: List[float] = []
+        result = self.__evaluate(now, deadlines)
+        future = [d for d in deadlines if d > now]
+        return result, min(future) if future else None
+
+    # parsing
+
+    @staticmethod
+    def __tokenize(expression: str) -> List[str]:
+        tokens = []
+        pos = 0
+        expression = expression.strip()
+        while pos < len(expression):
+            match = TOKEN_RE.match(expression, pos)
+            if not match:
+                raise ValueError(f"invalid character at '{expression[pos:]}' in trigger rule '{expression}'")
+            token = match.group(1)
+            tokens.append(token.lower() if token[0].isalpha() else token)
+            pos = match.end()
+        return tokens
+
+    def __peek(self) -> Optional[str]:
+        return self.__tokens[self.__pos] if self.__pos < len(self.__tokens) else None
+
+    def __next(self) -> str:
+        token = self.__peek()
+        if token is None:
+            raise ValueError(f"unexpected end of trigger rule '{self.expression}'")
+        self.__pos += 1
+        return token
+
+    def __number(self) -> float:
+        token = self.__next()
+        try:
+            return float(token)
+        except ValueError:
+            raise ValueError(f"expected a number instead of '{token}' in trigger rule '{self.expression}'")
+
+    def __parse_rule(self):
+        node = self.__parse_any()
+        if self.__peek() == "unless":
+            self.__next()
+            node = ("and", [node, ("not", self.__parse_any())])
+        return node
+
+    def __parse_any(self):
+        nodes = [self.__parse_all()]
+        while self.__peek() == "or":
+            self.__next()
+            nodes.append(self.__parse_all())
+        return nodes[0] if len(nodes) == 1 else ("or", nodes)
+
+    def __parse_all(self):
+        nodes = [self.__parse_unary()]
+        while self.__peek() == "and":
+            self.__next()
+            nodes.append(self.__parse_unary())
+        node = nodes[0] if len(nodes) == 1 else ("and", nodes)
+
+        if self.__peek() == "within":
+            self.__next()
+            window_s = self.__number()
+            if self.__peek() in ["s", "sec"]:
+                self.__next()
+            node = ("within", window_s, node)
+        return node
+
+    def __parse_unary(self):
+        token = self.__next()
+        if token == "not":
+            return ("not", self.__parse_unary())
+        if token == "(":
+            node = self.__parse_rule()
+            if self.__next() != ")":
+                raise ValueError(f"missing ')' in trigger rule '{self.expression}'")
+            return node
+        if token in ["true", "false"]:
+            return ("const", token == "true")
+        if token in KEYWORDS or not token[0].isalpha():
+            raise ValueError(f"unexpected '{token}' in trigger rule '{self.expression}'")
+        if token not in self.units:
+            raise ValueError(f"unknown unit '{token}' in trigger rule '{self.expression}', use one of {list(self.units)}")
+
+        count = None
+        if self.__peek() in [">=", "≥"]:
+            self.__next()
+            count = int(self.__number())
+            self.counted_units.add(self.units[token])
+        return ("unit", token, count)
+
+    # compilation
+
+    def __compile(self, node, window_s: Optional[float]) -> Evaluator:
+        kind = node[0]
+
+        if kind == "const":
+            value = node[1]
+            return lambda now, deadlines: value
+
+        if kind == "not":
+            child = self.__compile(node[1], window_s)
+            return lambda now, deadlines: not child(now, deadlines)
+
+        if kind == "and":
+            children = [self.__compile(n, window_s) for n in node[1]]
+            return lambda now, deadlines: all(child(now, deadlines) for child in children)
+
+        if kind == "or":
+            children = [self.__compile(n, window_s) for n in node[1]]
+            return lambda now, deadlines: any(child(now, deadlines) for child in children)
+
+        if kind == "within":
+            return self.__compile(node[2], node[1])
+
+        _, name, count = node
+        return self.__compile_unit(self.states[self.units[name]], count, window_s)
+
+    @staticmethod
+    def __compile_unit(state: UnitState, count: Optional[int], window_s: Optional[float]) -> Evaluator:
+        if count is None and window_s is None:
+
+            def triggered(now: float, deadlines: List[float]) -> bool:
+                return state.active
+
+            return triggered
+
+        if count is None:
+
+            def triggered_within(now: float, deadlines: List[float]) -> bool:
+                if state.active:
+                    return True
+                deadlines.append(state.off_ts + window_s)
+                return now - state.off_ts <= window_s
+
+            return triggered_within
+
+        if window_s is None:
+
+            def detected(now: float, deadlines: List[float]) -> bool:
+                return state.active and state.episode_detections >= count
+
+            return detected
+
+        state.window_s = max(state.window_s, window_s)
+
+        def detected_within(now: float, deadlines: List[float]) -> bool:
+            # drop detections outside of all windows, the deque is sorted by time
+            while state.detections and now - state.detections[0] > state.window_s:
+                state.detections.popleft()
+            if len(state.detections) < count or now - state.detections[-count] > window_s:
+                return False
+            deadlines.append(state.detections[-count] + window_s)
+            return True
+
+        return detected_within
@@ -1,4 +1,5 @@
 import asyncio
+import csv
 import datetime
 import json
 import logging
@@ -10,7 +11,7 @@ import threading
 import wave
 import platform
 from distutils.util import strtobool
-from typing import Callable, Dict, List, Optional, Tuple, Union, Optional
+from typing import Callable, Dict, Iterable, List, Optional, Tuple, Union, Optional
 from queue import Empty, Queue
 
 import gpiozero
@@ -24,21 +25,48 @@ import subprocess
 from radiotracking import MatchedSignal
 from radiotracking.consume import uncborify
 
+from batrack.detector import BatCall, CallDetector, NoiseFloor
+from batrack.events import WAVE_HEADER_BYTES, EventIndex
+from batrack.preview import SpectrogramPreview
+from batrack.storage import StorageManager
+
 logger = logging.getLogger(__name__)
 
+# input stream supervision of the AudioAnalysisUnit
+STREAM_START_GRACE_S = 1.0
+STREAM_RECOVERED_S = 60.0
+USB_RESET_DELAY_S = 10.0
+
+# broadband floor of the gating energy check: median tracking step per block, and margin to resume the analysis
+GATING_FLOOR_STEP_DB = 0.05
+GATING_FLOOR_MARGIN_DB = 10.0
+
 
 class AbstractAnalysisUnit(threading.Thread):
+    # configuration values, which can be changed while the unit is running, and their conversion
+    RELOADABLE: Dict[str, Callable] = {}
+
     def __init__(
         self,
         use_trigger: Union[str, bool],
         trigger_callback: Callable,
         data_path: str = ".",
+        event_index: Optional[EventIndex] = None,
+        storage: Optional[StorageManager] = None,
         **kwargs,
     ):
         super().__init__()
 
         self.use_trigger: bool = strtobool(use_trigger) if isinstance(use_trigger, str) else bool(use_trigger)
         self.data_path: str = str(data_path)
+        self.event_index: Optional[EventIndex] = event_index
+        self.storage: Optional[StorageManager] = storage
+
+        # report every detection through the trigger callback, not only trigger changes
+        self.report_detections: bool = False
+
+        # guards the configuration against changes while it is used
+        self._config_lock = threading.RLock()
 
         self._trigger_callback: Callable = trigger_callback
 
@@ -64,6 +92,51 @@ class AbstractAnalysisUnit(threading.Thread):
         self._trigger = trigger
         self._trigger_callback(trigger, message)
 
+    def reconfigure(self, **kwargs) -> List[str]:
+        """Apply changed configuration values to the running sensor.
+
+        The values are applied atomically; if any value is invalid, the
+        previous configuration is restored.
+
+        Raises:
+            ValueError: format of an argument is not valid.
+
+        Returns:
+            List[str]: changed keys, which require to restart the sensor.
+        """
+        values = {k: self.RELOADABLE[k](v) for k, v in kwargs.items() if k in self.RELOADABLE}
+
+        with self._config_lock:
+            previous = {k: getattr(self, k) for k in values}
+            try:
+                for k, v in values.items():
+                    setattr(self, k, v)
+                self._apply_config(values)
+            except ValueError:
+                for k, v in previous.items():
+                    setattr(self, k, v)
+                self._apply_config(previous)
+                raise
+
+        if values:
+            logger.info(f"{self.__class__.__name__} reconfigured: {values}")
+        return [k for k in kwargs if k not in self.RELOADABLE]
+
+    def _apply_config(self, values: Dict):
+        """Rebuild state derived from the given, changed configuration values."""
+        pass
+
+    def get_config(self, keys: Iterable[str]) -> Dict:
+        """Return the current values of reloadable configuration keys, e.g. to restore them later."""
+        return {k: getattr(self, k) for k in keys if k in self.RELOADABLE}
+
+    def wake(self):
+        """Notify the sensor about activity detected by another sensor.
+
+        Sensors reducing their analysis while idle resume full operation.
+        """
+        pass
+
     def stop(self):
         """Stop and join the running threaded sensor."""
         self.stop_recording()
@@ -167,6 +240,35 @@ class CameraAnalysisUnit(AbstractAnalysisUnit):
 
 
 class AudioAnalysisUnit(AbstractAnalysisUnit):
+    RELOADABLE: Dict[str, Callable] = {
+        "threshold_dbfs": int,
+        "highpass_hz": int,
+        "lowpass_hz": int,
+        "wave_export_len_s": float,
+        "quiet_threshold_s": float,
+        "noise_threshold_s": float,
+        "trigger_channels_min": int,
+        "wave_split_channels": lambda v: bool(strtobool(v)) if isinstance(v, str) else bool(v),
+        "call_prominence_db": float,
+        "call_min_duration_s": float,
+        "call_max_duration_s": float,
+        "noise_margin_db": float,
+        "noise_bands": int,
+        "noise_percentile": float,
+        "noise_step_db": float,
+        "gating_skip_blocks": int,
+        "gating_idle_s": float,
+        "gating_wake_dbfs": lambda v: float(v) if v is not None else None,
+        "stall_timeout_s": float,
+        "stream_retries": int,
+        "usb_reset_command": str,
+        "wave_preview": lambda v: bool(strtobool(v)) if isinstance(v, str) else bool(v),
+        "preview_bands": int,
+        "preview_column_s": float,
+        "preview_summary_bands": int,
+        "preview_range_db": float,
+    }
+
     def __init__(
         self,
         threshold_dbfs: int,
@@ -177,6 +279,33 @@ class AudioAnalysisUnit(AbstractAnalysisUnit):
         sampling_rate: int = 250000,
         lowpass_hz: int = 42000,
         input_block_duration: float = 0.05,
+        input_device: str = "mic, input",
+        channels: int = 1,
+        combine_channels: Union[bool, str] = False,
+        trigger_channels_min: int = 1,
+        wave_split_channels: Union[bool, str] = False,
+        use_call_detector: Union[bool, str] = False,
+        call_nfft: int = 256,
+        call_hop: int = 128,
+        call_prominence_db: float = 15.0,
+        call_min_duration_s: float = 0.001,
+        call_max_duration_s: float = 0.05,
+        adaptive_threshold: Union[bool, str] = False,
+        noise_margin_db: float = 12.0,
+        noise_bands: int = 8,
+        noise_percentile: float = 0.5,
+        noise_step_db: float = 0.05,
+        gating_skip_blocks: int = 1,
+        gating_idle_s: float = 600,
+        gating_wake_dbfs: Optional[float] = None,
+        stall_timeout_s: Optional[float] = None,
+        stream_retries: int = 3,
+        usb_reset_command: str = "sudo uhubctl -a cycle -p 3 -l 1-1",
+        wave_preview: Union[bool, str] = False,
+        preview_bands: int = 64,
+        preview_column_s: float = 0.1,
+        preview_summary_bands: int = 8,
+        preview_range_db: float = 60.0,
         **kwargs,
     ):
         """Bat call audio sensor.
@@ -190,6 +319,33 @@ class AudioAnalysisUnit(AbstractAnalysisUnit):
             noise_threshold_s (float): Noise duration, to set trigger.
             sampling_rate (int, optional): Sampling rate of the microphone.
             input_block_duration (float, optional): Length of input blocks.
+            input_device (str, optional): Device index or comma-separated keywords of the input device name.
+            channels (int, optional): Number of input channels (microphones) to capture.
+            combine_channels (bool, optional): Detect pings on the loudest channel instead of per channel.
+            trigger_channels_min (int, optional): Number of channels with pings required to set the trigger.
+            wave_split_channels (bool, optional): Write one wave file per channel instead of an interleaved file.
+            use_call_detector (bool, optional): Detect pings as individual bat calls using the spectral CallDetector.
+            call_nfft (int, optional): Sub-window length of the call detector.
+            call_hop (int, optional): Sub-window hop of the call detector.
+            call_prominence_db (float, optional): Minimal distance of a call to the in-band median.
+            call_min_duration_s (float, optional): Minimal duration of a call.
+            call_max_duration_s (float, optional): Maximal duration of a call.
+            adaptive_threshold (bool, optional): Raise the loudness threshold to noise_margin_db above the tracked noise floor.
+            noise_margin_db (float, optional): Margin above the noise floor for a noisy block.
+            noise_bands (int, optional): Number of bands with individual noise floors.
+            noise_percentile (float, optional): Percentile of the band loudness tracked as noise floor.
+            noise_step_db (float, optional): Adaption of the noise floor per block.
+            gating_skip_blocks (int, optional): While idle, only every k-th block is analysed; 1 analyses all blocks.
+            gating_idle_s (float, optional): Duration without activity after which the analysis is gated.
+            gating_wake_dbfs (float, optional): RMS loudness of a skipped block to resume full analysis, defaults to threshold_dbfs - 6.
+            stall_timeout_s (float, optional): Duration without frames after which the input stream is reopened, defaults to two blocks.
+            stream_retries (int, optional): Reopen attempts before resetting usb, and after resetting usb before giving up.
+            usb_reset_command (str, optional): Command to power-cycle the usb hub of the microphone.
+            wave_preview (bool, optional): Write a spectrogram preview and per-second band energies of each wave file.
+            preview_bands (int, optional): Number of frequency bands of the spectrogram preview.
+            preview_column_s (float, optional): Duration of a spectrogram column, at least one block.
+            preview_summary_bands (int, optional): Number of bands of the per-second band energies.
+            preview_range_db (float, optional): Dynamic range of the spectrogram preview.
         """
         super().__init__(**kwargs)
 
@@ -198,77 +354,290 @@ class AudioAnalysisUnit(AbstractAnalysisUnit):
         self.highpass_hz: int = int(highpass_hz)
         self.lowpass_hz: int = int(lowpass_hz)
 
+        self.input_device: str = str(input_device)
+        self.channels: int = int(channels)
+        self.combine_channels: bool = strtobool(combine_channels) if isinstance(combine_channels, str) else bool(combine_channels)
+        self.trigger_channels_min: int = int(trigger_channels_min)
+        self.wave_split_channels: bool = strtobool(wave_split_channels) if isinstance(wave_split_channels, str) else bool(wave_split_channels)
+
+        if self.channels < 1:
+            raise ValueError(f"invalid number of channels: {self.channels}")
+
+        # channels evaluated by the trigger logic, either each channel or the combined loudest channel
+        self.trigger_channels: int = 1 if self.combine_channels else self.channels
+
         self.sampling_rate: int = int(sampling_rate)
         self.input_block_duration: float = float(input_block_duration)
         self.input_frames_per_block: int = int(self.sampling_rate * input_block_duration)
 
-        self.wave_export_len: float = float(wave_export_len_s) * self.sampling_rate
-
-        self.quiet_blocks_max: float = float(quiet_threshold_s) / input_block_duration
-        self.noise_blocks_max: float = float(noise_threshold_s) / input_block_duration
+        self.wave_export_len_s: float = float(wave_export_len_s)
+        self.quiet_threshold_s: float = float(quiet_threshold_s)
+        self.noise_threshold_s: float = float(noise_threshold_s)
 
         self.freq_bins_hz = np.arange((self.input_frames_per_block / 2) + 1) / (
                     self.input_frames_per_block / float(self.sampling_rate))
-
-        self.frame_count = 0
+        self._dbfs_reference: float = max(self.input_frames_per_block / 2.0, 1)
+
+        # optional spectral call detector, replacing the peak-based ping detection
+        self.use_call_detector: bool = strtobool(use_call_detector) if isinstance(use_call_detector, str) else bool(use_call_detector)
+        self.call_detector: Optional[CallDetector] = None
+        if self.use_call_detector:
+            self.call_detector = CallDetector(
+                sampling_rate=self.sampling_rate,
+                block_frames=self.input_frames_per_block,
+                highpass_hz=self.highpass_hz,
+                lowpass_hz=self.lowpass_hz,
+                threshold_db=self.threshold_dbfs,
+                channels=self.channels,
+                nfft=int(call_nfft),
+                hop=int(call_hop),
+                prominence_db=float(call_prominence_db),
+                min_duration_s=float(call_min_duration_s),
+                max_duration_s=float(call_max_duration_s),
+            )
+        self.call_prominence_db: float = float(call_prominence_db)
+        self.call_min_duration_s: float = float(call_min_duration_s)
+        self.call_max_duration_s: float = float(call_max_duration_s)
+        self.__callsfile = None
+        self.__calls_csv = None
+
+        # optional noise floor tracking, threshold_dbfs remains the lower bound of the threshold
+        self.adaptive_threshold: bool = strtobool(adaptive_threshold) if isinstance(adaptive_threshold, str) else bool(adaptive_threshold)
+        self.noise_margin_db: float = float(noise_margin_db)
+        self.noise_bands: int = int(noise_bands)
+        self.noise_percentile: float = float(noise_percentile)
+        self.noise_step_db: float = float(noise_step_db)
+        self.noise_floor: Optional[NoiseFloor] = None
+        if self.adaptive_threshold and self.call_detector:
+            logger.warning("adaptive_threshold applies to the block peak detection only, no noise floor is tracked with use_call_detector")
+
+        # cascade gating: while neither audio nor other sensors detected activity
+        # for gating_idle_s, only every k-th block and loud blocks are analysed
+        self.gating_skip_blocks: int = int(gating_skip_blocks)
+        self.gating_idle_s: float = float(gating_idle_s)
+        self.gating_wake_dbfs: Optional[float] = float(gating_wake_dbfs) if gating_wake_dbfs is not None else None
+        self._active_until: float = time.monotonic() + self.gating_idle_s
+        self.__skipped_blocks: int = 0
+        self.__gating_floor: Optional[np.ndarray] = None
+
+        # stream supervision
+        self.stall_timeout_s: float = float(stall_timeout_s) if stall_timeout_s is not None else 2 * self.input_block_duration
+        self.stream_retries: int = int(stream_retries)
+        self.usb_reset_command: str = str(usb_reset_command)
+        self.stream_restarts: int = 0
+        self._stream_open_ts: float = time.monotonic()
+        self._last_frame_ts: float = time.monotonic()
+        self._callback_active: bool = False
+
+        # samples captured since the unit was started, used to locate events in recordings
+        self.sample_count: int = 0
+
+        # spectrogram previews of the recordings, built from the spectra of the analysis
+        self.wave_preview: bool = strtobool(wave_preview) if isinstance(wave_preview, str) else bool(wave_preview)
+        self.preview_bands: int = int(preview_bands)
+        self.preview_column_s: float = float(preview_column_s)
+        self.preview_summary_bands: int = int(preview_summary_bands)
+        self.preview_range_db: float = float(preview_range_db)
+        self.__spectrum: Optional[Tuple[np.ndarray, np.ndarray, float]] = None
 
         # set pyaudio config
         self.pa: pyaudio.PyAudio = pyaudio.PyAudio()
 
-        self.__pings: int = 0
+        # per-channel detection state
+        self.__pings: np.ndarray = np.zeros(self.trigger_channels, dtype=int)
 
-        self.__noise_blocks: int = 0
-        self.__quiet_blocks: int = 0
+        self.__noise_blocks: np.ndarray = np.zeros(self.trigger_channels, dtype=int)
+        self.__quiet_blocks: np.ndarray = np.zeros(self.trigger_channels, dtype=int)
         self.__wavewriter: Optional[WaveWriter] = None
+        self.__wavewriter_stops: List[threading.Thread] = []
+
+        # derive the analysis parameters
+        self._apply_config({})
+
+    def _apply_config(self, values: Dict):
+        if not 1 <= self.trigger_channels_min <= self.trigger_channels:
+            raise ValueError(f"trigger_channels_min must be between 1 and {self.trigger_channels}, got {self.trigger_channels_min}")
+        if not self.highpass_hz < self.lowpass_hz:
+            raise ValueError(f"highpass_hz must be below lowpass_hz, got {self.highpass_hz} and {self.lowpass_hz}")
+
+        self.wave_export_len: float = self.wave_export_len_s * self.sampling_rate
+        self.quiet_blocks_max: float = self.quiet_threshold_s / self.input_block_duration
+        self.noise_blocks_max: float = self.noise_threshold_s / self.input_block_duration
+
+        # bins outside of the pass band, computed once instead of per block
+        self._band_stop: np.ndarray = (self.freq_bins_hz < self.highpass_hz) | (self.freq_bins_hz > self.lowpass_hz)
+
+        if self.call_detector:
+            self.call_detector.configure(
+                highpass_hz=self.highpass_hz,
+                lowpass_hz=self.lowpass_hz,
+                threshold_db=self.threshold_dbfs,
+                prominence_db=self.call_prominence_db,
+                min_duration_s=self.call_min_duration_s,
+                max_duration_s=self.call_max_duration_s,
+            )
+
+        # previews are created while recording, invalid options have to fail here instead of in the audio callback
+        if self.wave_preview:
+            SpectrogramPreview(
+                sampling_rate=self.sampling_rate,
+                channels=self.channels,
+                highpass_hz=self.highpass_hz,
+                lowpass_hz=self.lowpass_hz,
+                bands=self.preview_bands,
+                column_s=self.preview_column_s,
+                summary_bands=self.preview_summary_bands,
+                range_db=self.preview_range_db,
+            )
+
+        # the noise floor is kept, unless its bands changed
+        band_plan = {"highpass_hz", "lowpass_hz", "noise_bands"}
+        if self.adaptive_threshold and not self.call_detector and (not self.noise_floor or band_plan & values.keys()):
+            self.noise_floor = NoiseFloor(
+                freq_bins_hz=self.freq_bins_hz,
+                highpass_hz=self.highpass_hz,
+                lowpass_hz=self.lowpass_hz,
+                min_db=self.threshold_dbfs - self.noise_margin_db,
+                channels=self.channels,
+                bands=self.noise_bands,
+                percentile=self.noise_percentile,
+                step_db=self.noise_step_db,
+            )
+        elif self.noise_floor:
+            self.noise_floor.configure(min_db=self.threshold_dbfs - self.noise_margin_db, percentile=self.noise_percentile, step_db=self.noise_step_db)
+
+        # block energy for gating_wake_dbfs, avoids the log per block; scaled by the power gain
+        # of the second-difference pre-emphasis at highpass_hz, which suppresses wind and rain
+        wake_dbfs = self.gating_wake_dbfs if self.gating_wake_dbfs is not None else self.threshold_dbfs - 6.0
+        pre_emphasis_gain = (2 * np.sin(np.pi * self.highpass_hz / self.sampling_rate)) ** 4
+        self._gating_wake_power: float = 10 ** (wake_dbfs / 10.0) * self.input_frames_per_block * pre_emphasis_gain
 
     def run(self):
         self._running = True
 
-        # open input stream
-        device_index = self.__find_input_device()
-
-        def callback(in_data, frame_count, time_info, status):
-            self.frame_count += 1
-            self.__analyse_frame(in_data)
-
-            # if a wave file is opened, write the frame to this file
-            if self.__wavewriter:
-                self.__wavewriter.q.put(in_data)
-
-            return (in_data, pyaudio.paContinue)
-
-        stream = self.pa.open(
-            input_device_index=device_index,
-            format=pyaudio.paInt16,
-            channels=1,
-            rate=self.sampling_rate,
-            input=True,
-            frames_per_buffer=self.input_frames_per_block,
-            stream_callback=callback,
-        )
-
-        stream.start_stream()
-
-        while stream.is_active() and self._running:
-            time.sleep(2)
-            logger.info(f"houston we had {self.frame_count} frames")
-            if self.frame_count == 0:
-                logger.warning("houston we have a problem! No frames are arriving...")
-                logger.warning("Shutting down to come up well again...")
-                subprocess.Popen(["sudo uhubctl -a cycle -p 3 -l 1-1"], shell=True)
-                break
-            self.frame_count = 0
-
-        # left while-loop, clean up
+        # open the call list
+        if self.call_detector:
+            start_time_str = datetime.datetime.now().strftime("%Y-%m-%dT%H_%M_%S")
+            self.__callsfile = open(os.path.join(self.data_path, f"{start_time_str}_calls.csv"), "w")
+            self.__calls_csv = csv.writer(self.__callsfile)
+            self.__calls_csv.writerow(BatCall._fields)
+
+        # open input stream, recovering from stalls in-process
+        stream = self.__open_stream()
+        failures = 0
+        usb_reset = False
+
+        while self._running:
+            time.sleep(self.input_block_duration)
+
+            # a callback in progress (e.g. evaluating triggers) delays the next frames, but is not a stall
+            if stream and stream.is_active() and (self._callback_active or time.monotonic() - self._last_frame_ts < self.stall_timeout_s):
+                # the stream is considered recovered after running for a while
+                if failures and time.monotonic() - self._stream_open_ts > STREAM_RECOVERED_S:
+                    logger.info("input stream recovered")
+                    failures = 0
+                    usb_reset = False
+                continue
+
+            logger.warning("houston we have a problem! No frames are arriving...")
+            self.__close_stream(stream)
+            stream = None
+            failures += 1
+
+            # escalate to a power-cycle of the usb hub, and finally to a restart of the unit
+            if failures > self.stream_retries:
+                if usb_reset:
+                    logger.error(f"input stream failed after {self.stream_retries} retries and usb reset, shutting down to come up well again...")
+                    break
+
+                logger.warning(f"input stream failed after {self.stream_retries} retries, resetting usb: {self.usb_reset_command}")
+                subprocess.Popen([self.usb_reset_command], shell=True)
+                usb_reset = True
+                failures = 0
+                time.sleep(USB_RESET_DELAY_S)
+            else:
+                time.sleep(self.input_block_duration * failures)
+
+            self.stream_restarts += 1
+            stream = self.__open_stream()
+
+        # left while-loop, clean up; the recordings are finalized before the unit returns
         if self.__wavewriter:
             self.__wavewriter.stop()
+        for wavewriter_stop in self.__wavewriter_stops:
+            wavewriter_stop.join()
 
-        stream.stop_stream()
-        stream.close()
+        self.__close_stream(stream)
         self.pa.terminate()
 
+        if self.__callsfile:
+            self.__callsfile.close()
+
         logger.info(f"{self.__class__.__name__} termination finished")
 
+    def __callback(self, in_data, frame_count, time_info, status):
+        self._callback_active = True
+        try:
+            self._last_frame_ts = time.monotonic()
+            stream_sample = self.sample_count
+            self.sample_count += frame_count
+            with self._config_lock:
+                self.__analyse_frame(in_data)
+
+            # if a wave file is opened, write the frame and its spectrum to this file
+            wavewriter = self.__wavewriter
+            if wavewriter:
+                wavewriter.q.put((stream_sample, in_data, self.__spectrum))
+        finally:
+            self._last_frame_ts = time.monotonic()
+            self._callback_active = False
+
+        return (in_data, pyaudio.paContinue)
+
+    def __open_stream(self) -> Optional["pyaudio.Stream"]:
+        """
+        (re-)initializes portaudio, probes the input device and opens the input stream
+        :return: the started stream, None on failure
+        """
+        # a fresh portaudio instance is required to see re-enumerated devices
+        if self.stream_restarts:
+            self.pa.terminate()
+            self.pa = pyaudio.PyAudio()
+
+        # samples lost in between can't be part of a call
+        if self.call_detector:
+            self.call_detector.skip(0)
+
+        try:
+            stream = self.pa.open(
+                input_device_index=self.__find_input_device(),
+                format=pyaudio.paInt16,
+                channels=self.channels,
+                rate=self.sampling_rate,
+                input=True,
+                frames_per_buffer=self.input_frames_per_block,
+                stream_callback=self.__callback,
+            )
+            stream.start_stream()
+        except (OSError, ValueError) as e:
+            logger.error(f"opening input stream failed: {e}")
+            return None
+
+        # grant the stream some time to deliver the first frame
+        self._stream_open_ts = time.monotonic()
+        self._last_frame_ts = self._stream_open_ts + STREAM_START_GRACE_S
+        return stream
+
+    def __close_stream(self, stream: Optional["pyaudio.Stream"]):
+        if not stream:
+            return
+
+        try:
+            stream.stop_stream()
+            stream.close()
+        except OSError as e:
+            logger.warning(f"closing input stream failed: {e}")
+
     def start_recording(self):
         if not self.wave_export_len:
             logger.info("Wave export length is zero, not creating wave file.")
@@ -286,20 +655,48 @@ class AudioAnalysisUnit(AbstractAnalysisUnit):
         # TODO: isn't it enough to set self._reconging = False? In run()
         # __wave_finalize() is also called.
         if self.__wavewriter:
-            self.__wavewriter.stop()
+            # finalizing the files waits for the writer, which must not block the audio callback
+            wavewriter_stop = threading.Thread(target=self.__wavewriter.stop, name="WaveWriterStop")
+            wavewriter_stop.start()
+            self.__wavewriter_stops = [t for t in self.__wavewriter_stops if t.is_alive()] + [wavewriter_stop]
             self.__wavewriter = None
         self._recording = False
 
+    def wake(self):
+        self._active_until = time.monotonic() + self.gating_idle_s
+
+    @property
+    def gated(self) -> bool:
+        """Return, wether the analysis is reduced due to inactivity."""
+        return self.gating_skip_blocks > 1 and not self._trigger and time.monotonic() > self._active_until
+
+    def get_status(self) -> Dict:
+        status = super().get_status()
+        status["gated"] = self.gated
+        status["stream_restarts"] = self.stream_restarts
+        if self.noise_floor:
+            status["noise_floor_dbfs"] = self.noise_floor.floor_db.round(1).tolist()
+        return status
+
     def __find_input_device(self) -> Optional[int]:
         """
-        searches for a microphone and returns the device number
+        searches for a microphone providing the configured channels and returns the device number
         :return: the device id
         """
+        if self.input_device.isdigit():
+            logger.info(f"Using configured input device {self.input_device}")
+            return int(self.input_device)
+
+        keywords = [k.strip().lower() for k in self.input_device.split(",") if k.strip()]
+
         for device_index in range(self.pa.get_device_count()):
             dev_info = self.pa.get_device_info_by_index(device_index)
-            logger.debug(f"Device {device_index}: {dev_info['name']}")
+            logger.debug(f"Device {device_index}: {dev_info['name']} ({dev_info['maxInputChannels']} input channels)")
+
+            if dev_info["maxInputChannels"] < self.channels:
+                continue
 
-            for keyword in ["mic", "input"]:
+            for keyword in keywords:
                 if keyword in dev_info["name"].lower():
                     logger.info(f"Found an input: device {device_index} - {dev_info['name']}")
                     return device_index
@@ -307,78 +704,190 @@ class AudioAnalysisUnit(AbstractAnalysisUnit):
         logger.info("No preferred input found; using default input device.")
         return None
 
-    def __analyse_frame(self, frame: str):
+    def __analyse_frame(self, frame: bytes):
         """checks for the given frame if a trigger is present
 
         Args:
-            frame (str): the recorded audio frame to be analysed
+            frame (bytes): the recorded, interleaved audio frame to be analysed
+        """
+        samples = np.frombuffer(frame, dtype=np.int16).reshape(-1, self.channels)
+        self.__spectrum = None
+
+        if self.gated:
+            self.__skipped_blocks += 1
+            if self.__skipped_blocks < self.gating_skip_blocks and not self.__loud(samples):
+                if self.call_detector:
+                    self.call_detector.skip(samples.shape[0])
+                return
+            self.__skipped_blocks = 0
+
+        if self.call_detector:
+            pinged, quiet, ping_freqs_hz = self.__detect_calls(samples)
+        else:
+            pinged, quiet, ping_freqs_hz = self.__detect_peaks(samples)
+
+        if pinged.any():
+            self.wake()
+            self.__pings += pinged
+            logger.info(f"ping {self.__pings.tolist()}, channels {np.flatnonzero(pinged).tolist()}")
+
+        # set trigger and callback
+        # it's the second ping because of the *click* of the relays which
+        # is the first ping every time
+        # in the moment we done have a relay anymore we can delete the
+        # lower boundary
+        pinging = self.__pings >= 1
+        if np.count_nonzero(pinging) >= self.trigger_channels_min and not self._trigger:
+            self._set_trigger(True, f"audio, {self.__pings.tolist()} pings. Newest ping by frequency: {ping_freqs_hz[pinging].tolist()}")
+        elif pinged.any() and self._trigger and self.report_detections:
+            self._set_trigger(True, f"audio, {self.__pings.tolist()} pings. Newest ping by frequency: {ping_freqs_hz[pinged > 0].tolist()}")
+
+        # stop audio if thresbold of quiet blocks is met on all channels
+        if quiet.all() and (self.__quiet_blocks > self.quiet_blocks_max).all() and self._trigger:
+            self._set_trigger(False, f"audio, {self.__quiet_blocks.min()} quiet blocks")
+            self.__pings[:] = 0
+
+        noisy = ~quiet
+        self.__noise_blocks[noisy] += 1
+        self.__noise_blocks[quiet] = 0
+        self.__quiet_blocks[quiet] += 1
+        self.__quiet_blocks[noisy] = 0
+
+    def __loud(self, samples: np.ndarray) -> bool:
+        """coarse check of the block energy, used to resume the analysis of gated blocks
+
+        The second difference of the samples attenuates low frequencies
+        (e.g. wind) by 12 dB per octave below highpass_hz, without computing
+        a spectrum. Steady broadband noise (e.g. rain, self-noise) is
+        ignored by comparing to a tracked floor of the energy.
+
+        Args:
+            samples (np.ndarray): the samples of the block, one column per channel
+
+        Returns:
+            bool: True, if any channel exceeds gating_wake_dbfs
         """
+        emphasized = np.diff(samples.astype(np.float32), n=2, axis=0)
+        energy = np.einsum("ij,ij->j", emphasized, emphasized)
 
-        spectrum = self.__exec_fft(frame)
-        peak_db, peak_frequency_hz = self.__get_peak_db(spectrum)
+        if self.__gating_floor is None:
+            self.__gating_floor = energy.copy()
+        loud = (energy > self._gating_wake_power) & (energy > self.__gating_floor * 10 ** (GATING_FLOOR_MARGIN_DB / 10.0))
 
-        # noisy block
-        if peak_db > self.threshold_dbfs:
-            self.__quiet_blocks = 0
-            self.__noise_blocks += 1
+        # track the median of the energy
+        step = 10 ** (GATING_FLOOR_STEP_DB / 10.0)
+        self.__gating_floor *= np.where(energy > self.__gating_floor, step, 1.0 / step)
 
-        # quiet block
+        if loud.any():
+            logger.debug(f"block of channels {np.flatnonzero(loud).tolist()} exceeds the gating threshold, resuming analysis")
+            self.wake()
+            return True
+
+        return False
+
+    def __detect_peaks(self, samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """detect pings based on the peak loudness of the whole block
+
+        Args:
+            samples (np.ndarray): the samples of the block, one column per channel
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: pings, quiet state and peak frequency per trigger channel
+        """
+        spectrum = self.__exec_fft(samples)
+        self.__spectrum = (spectrum, self.freq_bins_hz, self._dbfs_reference)
+        dbfs_spectrum = self.__get_dbfs(spectrum)
+        peak_db, peak_frequency_hz = self.__get_peak_db(dbfs_spectrum)
+
+        # loudness above the threshold, which is raised above the noise floor of each band if configured
+        if self.noise_floor:
+            band_db = self.noise_floor.band_db(dbfs_spectrum)
+            excess_db = (band_db - np.maximum(self.noise_floor.floor_db + self.noise_margin_db, self.threshold_dbfs)).max(axis=1)
+            self.noise_floor.update(band_db)
         else:
-            # ping detection; a ping has to be a noisy sequence which is not
-            # longer than self.noise_blocks_max
-            if 1 <= self.__noise_blocks <= self.noise_blocks_max:
-                logger.info(f"ping {self.__pings}")
-                self.__pings += 1
-
-            # set trigger and callback
-            # it's the second ping because of the *click* of the relays which
-            # is the first ping every time
-            # in the moment we done have a relay anymore we can delete the
-            # lower boundary
-            if 1 <= self.__pings and not self._trigger:
-                self._set_trigger(True, f"audio, {self.__pings} pings. Newest ping by frequency: {peak_frequency_hz}")
-
-            # stop audio if thresbold of quiet blocks is met
-            if self.__quiet_blocks > self.quiet_blocks_max and self._trigger:
-                self._set_trigger(False, f"audio, {self.__quiet_blocks} quiet blocks")
-                self.__pings = 0
-
-            self.__noise_blocks = 0
-            self.__quiet_blocks += 1
-
-    def __exec_fft(self, signal) -> np.fft.rfft:
-        """execute a fft on given samples and apply highpass filter
+            excess_db = peak_db - self.threshold_dbfs
+
+        # reduce to the loudest channel, if channels are not evaluated individually
+        if self.combine_channels:
+            loudest = excess_db.argmax()
+            excess_db = excess_db[loudest:loudest + 1]
+            peak_frequency_hz = peak_frequency_hz[loudest:loudest + 1]
+
+        quiet = excess_db <= 0
+
+        # ping detection; a ping has to be a noisy sequence which is not
+        # longer than self.noise_blocks_max, followed by a quiet block
+        pinged = quiet & (self.__noise_blocks >= 1) & (self.__noise_blocks <= self.noise_blocks_max)
+
+        return pinged.astype(int), quiet, peak_frequency_hz
+
+    def __detect_calls(self, samples: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """detect pings as individual bat calls and record their features
+
+        Args:
+            samples (np.ndarray): the samples of the block, one column per channel
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: calls, quiet state and newest call frequency per trigger channel
+        """
+        calls = self.call_detector.process(samples)
+        self.__spectrum = self.call_detector.spectrum
+
+        pinged = np.zeros(self.trigger_channels, dtype=int)
+        ping_freqs_hz = np.zeros(self.trigger_channels)
+        for call in calls:
+            logger.debug(f"call {call}")
+            c = 0 if self.combine_channels else call.channel
+            pinged[c] += 1
+            ping_freqs_hz[c] = call.peak_freq_hz
+
+            if self.__calls_csv:
+                self.__calls_csv.writerow(call)
+        if calls and self.__callsfile:
+            self.__callsfile.flush()
+
+        return pinged, pinged == 0, ping_freqs_hz
+
+    def __exec_fft(self, samples: np.ndarray) -> np.ndarray:
+        """execute a fft on all channels of the given samples and apply highpass filter
 
         Args:
-            signal ([type]): the input samples
+            samples (np.ndarray): the input samples, one column per channel
 
         Returns:
-            np.fft.rfft: highpass-filtered spectrum
+            np.ndarray: highpass-filtered spectrum, one row per channel
         """
-        # do the fft
-        data_int16 = np.frombuffer(signal, dtype=np.int16)
-        spectrum = np.fft.rfft(data_int16)
+        # do the fft on all channels at once
+        spectrum = np.fft.rfft(samples, axis=0).T
 
         # apply the highpass
-        spectrum[self.freq_bins_hz < self.highpass_hz] = 0.000000001
-        spectrum[self.freq_bins_hz > self.lowpass_hz] = 0.000000001
+        spectrum[:, self._band_stop[:spectrum.shape[1]]] = 0.000000001
 
         return spectrum
 
-    def __get_peak_db(self, spectrum: np.fft) -> Tuple[float, int]:
-        """extract the maximal volume of a given spectrum
+    def __get_dbfs(self, spectrum: np.ndarray) -> np.ndarray:
+        """convert a spectrum to dBFS
 
         Args:
-            spectrum (np.fft): spectrum to analyze
+            spectrum (np.ndarray): spectrum to convert, one row per channel
 
         Returns:
-            float: the retrieved maximum
+            np.ndarray: the loudness of each bin
         """
+        with np.errstate(divide="ignore"):
+            return 20 * np.log10(np.abs(spectrum) / self._dbfs_reference)
 
-        window_function_dbfs_max = np.sum(self.input_frames_per_block) / 2.0
-        dbfs_spectrum = 20 * np.log10(np.abs(spectrum) / max([window_function_dbfs_max, 1]))
-        bin_peak_index = dbfs_spectrum.argmax()
-        peak_db = dbfs_spectrum[bin_peak_index]
+    def __get_peak_db(self, dbfs_spectrum: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """extract the maximal volume per channel of a given spectrum
+
+        Args:
+            dbfs_spectrum (np.ndarray): spectrum in dBFS to analyze, one row per channel
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: the retrieved maximum and its frequency per channel
+        """
+        bin_peak_index = dbfs_spectrum.argmax(axis=1)
+        peak_db = dbfs_spectrum[np.arange(len(bin_peak_index)), bin_peak_index]
         peak_frequency_hz = bin_peak_index * self.sampling_rate / self.input_frames_per_block
         logger.debug(f"Peak freq hz: {peak_frequency_hz} dBFS: {peak_db}")
         return peak_db, peak_frequency_hz
@@ -389,20 +898,22 @@ class WaveWriter(threading.Thread):
         super().__init__()
         self.aau: AudioAnalysisUnit = aau
 
-        start_time_str = datetime.datetime.now().strftime("%Y-%m-%dT%H_%M_%S")
-        file_path = os.path.join(aau.data_path, start_time_str + ".wav")
-
-        logger.info(f"creating wav file '{file_path}'")
-        self.__wave = wave.open(file_path, "wb")
-        self.__wave.setnchannels(1)
-        self.__wave.setsampwidth(aau.pa.get_sample_size(pyaudio.paInt16))
-        self.__wave.setframerate(aau.sampling_rate)
+        self.__sample_width: int = aau.pa.get_sample_size(pyaudio.paInt16)
+        self.__frame_bytes: int = self.__sample_width * aau.channels
+        self.__waves: List[wave.Wave_write] = []
+        self.__paths: List[str] = []
+        self.__recording_ids: List[int] = []
+        self.__previews: List[SpectrogramPreview] = []
+        self.__nframes: int = 0
+        self.__wave_open()
 
         self._running = False
         self.q: Queue = Queue()
 
     def stop(self):
         self._running = False
+        # wake up the writer waiting for frames
+        self.q.put(None)
         self.join()
 
     def run(self):
@@ -410,34 +921,160 @@ class WaveWriter(threading.Thread):
 
         while self._running:
             try:
-                frame = self.q.get(block=True, timeout=1)
-                self.__wave_write(frame)
+                item = self.q.get(block=True, timeout=1)
+                if item is None:
+                    continue
+                stream_sample, frame, spectrum = item
+                self.__wave_write(stream_sample, frame, spectrum)
             except Empty:
-                break
+                # keep the file open while the input stream recovers
+                continue
 
         self.__wave_finalize()
 
-    def __wave_write(self, frame):
-        remaining_length = int(self.aau.wave_export_len - self.__wave._nframeswritten)
+    def __wave_open(self):
+        start_time_str = datetime.datetime.now().strftime("%Y-%m-%dT%H_%M_%S")
+
+        if self.aau.wave_split_channels and self.aau.channels > 1:
+            file_paths = [os.path.join(self.aau.data_path, f"{start_time_str}_ch{c}.wav") for c in range(self.aau.channels)]
+            nchannels = 1
+        else:
+            file_paths = [os.path.join(self.aau.data_path, start_time_str + ".wav")]
+            nchannels = self.aau.channels
+
+        for file_path in file_paths:
+            logger.info(f"creating wav file '{file_path}'")
+            w = wave.open(file_path, "wb")
+            w.setnchannels(nchannels)
+            w.setsampwidth(self.__sample_width)
+            w.setframerate(self.aau.sampling_rate)
+            self.__waves.append(w)
+            self.__paths.append(file_path)
+
+            if self.aau.wave_preview:
+                self.__previews.append(
+                    SpectrogramPreview(
+                        sampling_rate=self.aau.sampling_rate,
+                        channels=nchannels,
+                        highpass_hz=self.aau.highpass_hz,
+                        lowpass_hz=self.aau.lowpass_hz,
+                        bands=self.aau.preview_bands,
+                        column_s=self.aau.preview_column_s,
+                        summary_bands=self.aau.preview_summary_bands,
+                        range_db=self.aau.preview_range_db,
+                    )
+                )
+
+        self.__nframes = 0
+        self.__start_ts = time.time()
+
+    def __wave_register(self, stream_sample: int):
+        """add the opened files to the event index, starting at the given stream sample"""
+        nchannels = self.__waves[0].getnchannels()
+        self.__recording_ids = [
+            self.aau.event_index.add_recording(
+                unit=self.aau.__class__.__name__,
+                path=path,
+                stream_sample=stream_sample,
+                channels=nchannels,
+                sampling_rate=self.aau.sampling_rate,
+                sample_width=self.__sample_width,
+                data_offset=WAVE_HEADER_BYTES,
+            )
+            for path in self.__paths
+        ]
+
+    def __preview_add(self, samples: np.ndarray, spectrum: Optional[Tuple[np.ndarray, np.ndarray, float]]):
+        """add a block to the previews, reusing the spectrum of the analysis if available"""
+        for c, preview in enumerate(self.__previews):
+            # split files preview a single channel
+            channels = slice(c, c + 1) if len(self.__previews) > 1 else slice(None)
+            if spectrum is None:
+                preview.add_samples(samples[:, channels])
+            else:
+                magnitude, freqs_hz, reference = spectrum
+                preview.add(magnitude[channels], freqs_hz, reference, samples.shape[0])
 
-        if len(frame) > remaining_length:
+    def __wave_write(self, stream_sample: int, frame: bytes, spectrum: Optional[Tuple[np.ndarray, np.ndarray, float]] = None):
+        remaining_length = int(self.aau.wave_export_len - self.__nframes)
+        frame_len = len(frame) // self.__frame_bytes
+
+        if frame_len > remaining_length:
             logger.info("wave reached maximum, starting new file...")
             self.__wave_finalize()
-            self.start()
+            self.__wave_open()
+
+        if self.aau.event_index and not self.__recording_ids:
+            self.__wave_register(stream_sample)
+
+        logger.debug(f"writing frame, len: {frame_len}")
+        samples = np.frombuffer(frame, dtype=np.int16).reshape(-1, self.aau.channels)
+        if len(self.__waves) == 1:
+            self.__waves[0].writeframes(frame)
+        else:
+            for c, w in enumerate(self.__waves):
+                w.writeframes(samples[:, c].tobytes())
+
+        if self.__previews:
+            self.__preview_add(samples, spectrum)
 
-        logger.debug(f"writing frame, len: {len(frame)}")
-        self.__wave.writeframes(frame)
+        self.__nframes += frame_len
 
     def __wave_finalize(self):
-        if not self.__wave:
+        if not self.__waves:
             logger.warning("no wave is opened, skipping finalization request")
             return
 
-        self.__wave.close()
-        self.__wave = None
+        for w in self.__waves:
+            w.close()
+        self.__waves = []
+
+        # previews are kept next to the recordings, and are not evicted with them
+        for path, preview in zip(self.__paths, self.__previews):
+            base_path = os.path.splitext(path)[0]
+            try:
+                preview.write(f"{base_path}_preview.png", f"{base_path}_bands.csv")
+            except OSError as e:
+                logger.error(f"preview of '{path}' can't be written: {e}")
+        self.__previews = []
+
+        if self.aau.storage:
+            for path in self.__paths:
+                self.aau.storage.add_recording(self.aau.__class__.__name__, path, self.__start_ts)
+        self.__paths = []
+
+        if self.aau.event_index:
+            for recording_id in self.__recording_ids:
+                self.aau.event_index.finish_recording(recording_id, self.__nframes)
+        self.__recording_ids = []
+
+
+def parse_freqs(sig_freqs_mhz: Union[str, List[float]]) -> List[float]:
+    """Parse a list of frequencies, given as list or json string.
+
+    Raises:
+        ValueError: format of an argument is not valid.
+    """
+    if isinstance(sig_freqs_mhz, list):
+        return [float(f) for f in sig_freqs_mhz]
+    elif isinstance(sig_freqs_mhz, str):
+        return [float(f) for f in json.loads(sig_freqs_mhz)]
+    else:
+        raise ValueError(f"invalid format for frequencies, {type(sig_freqs_mhz)}:'{sig_freqs_mhz}'")
 
 
 class VHFAnalysisUnit(AbstractAnalysisUnit):
+    RELOADABLE: Dict[str, Callable] = {
+        "freq_bw_hz": int,
+        "sig_freqs_mhz": parse_freqs,
+        "sig_threshold_dbw": float,
+        "sig_duration_threshold_s": float,
+        "freq_active_window_s": float,
+        "freq_active_var": float,
+        "freq_active_count": int,
+        "untrigger_duration_s": float,
+    }
+
     def __init__(
         self,
         freq_bw_hz: int,
@@ -474,21 +1111,11 @@ class VHFAnalysisUnit(AbstractAnalysisUnit):
         self.freq_bw_hz: int = int(freq_bw_hz)
 
         # signal-specific configuration and thresholds
-        if isinstance(sig_freqs_mhz, list):
-            sig_freqs_mhz = [float(f) for f in sig_freqs_mhz]
-        elif isinstance(sig_freqs_mhz, str):
-            sig_freqs_mhz = [float(f) for f in json.loads(sig_freqs_mhz)]
-        else:
-            raise ValueError(f"invalid format for frequencies, {type(sig_freqs_mhz)}:'{sig_freqs_mhz}'")
+        self.sig_freqs_mhz: List[float] = parse_freqs(sig_freqs_mhz)
 
         # freqs_bins to contain old signal values for variance calc
         self._freqs_bins: Dict[float, Tuple[float, float, List[Tuple[datetime.datetime, float]]]] = {}
-        for freq_mhz in sig_freqs_mhz:
-            freq_rel = int(freq_mhz * 1000 * 1000)
-            lower = freq_rel - (self.freq_bw_hz / 2)
-            upper = freq_rel + (self.freq_bw_hz / 2)
-
-            self._freqs_bins[freq_mhz] = (lower, upper, [])
+        self._apply_config({})
 
         self.sig_threshold_dbw = float(sig_threshold_dbw)
         # TODO: Signal duration threshold is not yet used
@@ -508,6 +1135,20 @@ class VHFAnalysisUnit(AbstractAnalysisUnit):
 
         self.untrigger_ts = time.time()
 
+    def _apply_config(self, values: Dict):
+        # rebuild the frequency bins, keeping the signals of unchanged frequencies;
+        # the bins are replaced at once, as they are used by the mqtt thread
+        freqs_bins = {}
+        for freq_mhz in self.sig_freqs_mhz:
+            freq_rel = int(freq_mhz * 1000 * 1000)
+            lower = freq_rel - (self.freq_bw_hz / 2)
+            upper = freq_rel + (self.freq_bw_hz / 2)
+            sigs = self._freqs_bins[freq_mhz][2] if freq_mhz in self._freqs_bins else []
+
+            freqs_bins[freq_mhz] = (lower, upper, sigs)
+
+        self._freqs_bins = freqs_bins
+
     def start_recording(self):
         # the vhf sensor is recording continuously
         pass
@@ -0,0 +1,237 @@
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from queue import Queue
+from typing import Dict, Optional, Tuple
+
+from batrack.events import EventIndex
+
+logger = logging.getLogger(__name__)
+
+# eviction frees space down to this fraction of a budget, to avoid evicting on every recording
+EVICTION_WATERMARK = 0.9
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    unit TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    value INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_eviction ON files (unit, value, ts);
+"""
+
+
+class StorageManager:
+    def __init__(
+        self,
+        data_path: str,
+        budgets_bytes: Dict[str, int],
+        min_free_bytes: int = 0,
+        eviction: str = "value",
+        event_index: Optional[EventIndex] = None,
+    ):
+        """Byte budgets per unit with eviction of old or low-value recordings.
+
+        Finished recordings are kept in a persistent inventory in the data
+        path, so the usage of each unit is known without walking the file
+        system. If a unit exceeds its budget, or the file system runs low on
+        space, recordings of the unit are evicted; new recordings are
+        rejected while no space could be freed.
+
+        Accounting and eviction run in a worker thread, so callers (e.g. the
+        trigger evaluation in the audio callback) never wait for file system
+        operations; admission is decided on the cached usage.
+
+        Args:
+            data_path (str): Path of the data and the inventory.
+            budgets_bytes (Dict[str, int]): Budget per unit class name, 0 for unlimited.
+            min_free_bytes (int, optional): Space to keep free on the file system.
+            eviction (str, optional): "oldest" or "value", evicting recordings with the fewest trigger events first.
+            event_index (Optional[EventIndex], optional): Event index used to rate recordings.
+
+        Raises:
+            ValueError: format of an argument is not valid.
+        """
+        self.data_path: str = str(data_path)
+        self.event_index: Optional[EventIndex] = event_index
+        self.configure(budgets_bytes, min_free_bytes, eviction)
+
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.data_path, "storage.sqlite"), check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._db.commit()
+
+        # usage per unit, updated incrementally
+        self.used_bytes: Dict[str, int] = {unit: 0 for unit in self.budgets_bytes}
+        self.used_bytes.update(self._db.execute("SELECT unit, SUM(bytes) FROM files GROUP BY unit").fetchall())
+        logger.info(f"storage usage: {self.used_bytes}")
+
+        # free space of the file system, refreshed on every enforcement and status request
+        self.cached_free_bytes: int = self.free_bytes()
+
+        # accounting and eviction requests: unit, path, start and stop of a recording, path is None for an eviction only
+        self._tasks: "Queue[Optional[Tuple[str, Optional[str], float, float]]]" = Queue()
+        self._worker = threading.Thread(target=self.__work, name="StorageManager", daemon=True)
+        self._worker.start()
+
+    def configure(self, budgets_bytes: Dict[str, int], min_free_bytes: int, eviction: str):
+        """Set the budgets and the eviction strategy, applied on the next recording.
+
+        Raises:
+            ValueError: format of an argument is not valid.
+        """
+        self.check_eviction(eviction)
+
+        self.budgets_bytes: Dict[str, int] = {unit: int(budget) for unit, budget in budgets_bytes.items()}
+        self.min_free_bytes: int = int(min_free_bytes)
+        self.eviction: str = eviction
+
+    @staticmethod
+    def check_eviction(eviction: str):
+        """Validate an eviction strategy.
+
+        Raises:
+            ValueError: the strategy is not valid.
+        """
+        if eviction not in ["oldest", "value"]:
+            raise ValueError(f"invalid eviction strategy '{eviction}', use 'oldest' or 'value'")
+
+    def close(self):
+        # finish the pending accounting before closing the inventory
+        self._tasks.put(None)
+        self._worker.join()
+        with self._lock:
+            self._db.close()
+
+    def __work(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+
+            unit, path, start_ts, stop_ts = task
+            try:
+                if path:
+                    self.__account(unit, path, start_ts, stop_ts)
+                self.enforce(unit)
+            except Exception as e:
+                logger.error(f"storage task of {unit} failed: {e}")
+
+    def request_enforce(self, unit: str):
+        """Evict recordings of a unit in the background, if it exceeds its budget or the minimal free space."""
+        self._tasks.put((unit, None, 0.0, 0.0))
+
+    def free_bytes(self) -> int:
+        return shutil.disk_usage(self.data_path).free
+
+    def add_recording(self, unit: str, path: str, start_ts: float, stop_ts: Optional[float] = None):
+        """Account a finished recording and evict recordings, if the unit exceeds its budget.
+
+        The recording is accounted in the background.
+
+        Args:
+            unit (str): Name of the recording unit.
+            path (str): Path of the recorded file.
+            start_ts (float): Start of the recording.
+            stop_ts (Optional[float], optional): End of the recording, defaults to now.
+        """
+        self._tasks.put((unit, path, start_ts, stop_ts or time.time()))
+
+    def __account(self, unit: str, path: str, start_ts: float, stop_ts: float):
+        try:
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning(f"recording '{path}' can't be accounted: {e}")
+            return
+
+        value = 0
+        if self.event_index:
+            value = self.event_index.count_trigger_events(start_ts, stop_ts)
+
+        with self._lock:
+            # a recording accounted again replaces its previous size
+            replaced = self._db.execute("SELECT unit, bytes FROM files WHERE path = ?", (path,)).fetchone()
+            self._db.execute("INSERT OR REPLACE INTO files (path, unit, bytes, ts, value) VALUES (?, ?, ?, ?, ?)", (path, unit, size, start_ts, value))
+            self._db.commit()
+            if replaced:
+                self.used_bytes[replaced[0]] -= replaced[1]
+            self.used_bytes[unit] = self.used_bytes.get(unit, 0) + size
+
+        logger.debug(f"accounted '{path}' ({size} bytes, value {value}) to {unit}")
+
+    def __over_budget(self, unit: str, watermark: float = 1.0, cached: bool = False) -> bool:
+        budget = self.budgets_bytes.get(unit, 0)
+        if budget and self.used_bytes.get(unit, 0) > budget * watermark:
+            return True
+        if not cached:
+            self.cached_free_bytes = self.free_bytes()
+        if self.min_free_bytes and self.cached_free_bytes < self.min_free_bytes / watermark:
+            return True
+        return False
+
+    def enforce(self, unit: str) -> bool:
+        """Evict recordings of a unit until it fits its budget and the minimal free space.
+
+        Args:
+            unit (str): Name of the unit.
+
+        Returns:
+            bool: True, if the unit is within its budget.
+        """
+        if not self.__over_budget(unit):
+            return True
+
+        order = "ts" if self.eviction == "oldest" else "value, ts"
+        with self._lock:
+            for path, size in self._db.execute(f"SELECT path, bytes FROM files WHERE unit = ? ORDER BY {order}", (unit,)).fetchall():
+                if not self.__over_budget(unit, EVICTION_WATERMARK):
+                    break
+
+                logger.info(f"evicting '{path}' ({size} bytes) of {unit}")
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    logger.warning(f"evicted recording '{path}' was already removed")
+                except OSError as e:
+                    logger.error(f"recording '{path}' can't be evicted: {e}")
+                    continue
+
+                self._db.execute("DELETE FROM files WHERE path = ?", (path,))
+                self.used_bytes[unit] -= size
+            self._db.commit()
+
+        return not self.__over_budget(unit)
+
+    def admit(self, unit: str) -> bool:
+        """Check if a unit may start a new recording, based on the cached usage and free space.
+
+        A rejected unit is evicted in the background.
+
+        Args:
+            unit (str): Name of the unit.
+
+        Returns:
+            bool: True, if the recording may start.
+        """
+        if not self.__over_budget(unit, cached=True):
+            return True
+
+        logger.warning(f"storage of {unit} exhausted ({self.used_bytes.get(unit, 0)} bytes used, {self.cached_free_bytes} bytes free), rejecting recording")
+        self.request_enforce(unit)
+        return False
+
+    def get_status(self, unit: str) -> Dict:
+        budget = self.budgets_bytes.get(unit, 0)
+        used = self.used_bytes.get(unit, 0)
+        free = self.cached_free_bytes = self.free_bytes()
+        return {
+            "used_bytes": used,
+            "budget_bytes": budget,
+            "remaining_bytes": min(budget - used, free) if budget else free,
+            "free_bytes": free,
+        }
@@ -0,0 +1,34 @@
+import numpy as np
+
+from batrack.detector import CallDetector
+
+SAMPLING_RATE = 250000
+BLOCK_FRAMES = 12500
+
+
+def make_detector() -> CallDetector:
+    return CallDetector(
+        sampling_rate=SAMPLING_RATE,
+        block_frames=BLOCK_FRAMES,
+        highpass_hz=15000,
+        lowpass_hz=120000,
+        threshold_db=40,
+    )
+
+
+def test_call_ending_at_block_boundary():
+    # a call continued from the first block may end with the first sub-window of the second block
+    rng = np.random.default_rng(0)
+    for end_offset in range(0, 400, 5):
+        samples = rng.normal(0, 5, 2 * BLOCK_FRAMES)
+        stop = BLOCK_FRAMES - end_offset
+        t = np.arange(1500) / SAMPLING_RATE
+        samples[stop - 1500 : stop] += 3000 * np.sin(2 * np.pi * 30000 * t)
+        samples = samples.astype(np.int16)[:, None]
+
+        detector = make_detector()
+        calls = detector.process(samples[:BLOCK_FRAMES]) + detector.process(samples[BLOCK_FRAMES:])
+
+        assert len(calls) == 1, f"end_offset {end_offset}"
+        assert abs(calls[0].peak_freq_hz - 30000) < 1000
+        assert 0.005 <= calls[0].duration_s <= 0.008